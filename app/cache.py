@@ -0,0 +1,177 @@
+import json
+import os
+from collections import OrderedDict
+from tempfile import gettempdir
+from time import monotonic, time
+from typing import Type, Optional
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.queryset import QuerySet
+
+from app.models._utils import Model
+from app.models.data_version import DataVersion
+from app.xlsx import XlsxWriter, XLSX_MEDIA_TYPE
+
+COUNT_TTL = 60
+REPORT_CLEANUP_INTERVAL = 60
+COUNT_CACHE_SIZE = 1024
+REPORT_CACHE_SIZE = int(os.environ.get("REPORT_CACHE_SIZE", 128))
+REPORT_CACHE_TTL = int(os.environ.get("REPORT_CACHE_TTL", 60 * 60))
+REPORT_CACHE_DIR = os.environ.get("REPORT_CACHE_DIR", os.path.join(gettempdir(), "cw-report-cache"))
+
+_global_generation = 0
+_generations: dict[str, int] = {}
+_counts: OrderedDict[str, tuple[int, int, float]] = OrderedDict()
+
+
+def generation(model: Type[Model]) -> int:
+    return _global_generation + _generations.get(model._meta.db_table, 0)
+
+
+# Generation of the model and models it directly references, so counts filtered by fields of related models
+# (e.g. orders filtered by "customer__first_name") are invalidated together with these models.
+# Filters which follow more than one relation can still be stale for up to COUNT_TTL.
+def count_generation(model: Type[Model]) -> int:
+    meta = model._meta
+    related = {meta.fields_map[name].related_model for name in (*meta.fk_fields, *meta.o2o_fields)}
+    return generation(model) + sum(_generations.get(rel._meta.db_table, 0) for rel in related if rel is not model)
+
+
+# Marks cached data of given models as outdated, must be called after writes done through the api.
+# Without arguments invalidates data of all models (e.g. after raw sql was executed).
+def invalidate(*models: Type[Model]) -> None:
+    global _global_generation
+
+    if not models:
+        _global_generation += 1
+    for model in models:
+        table = model._meta.db_table
+        _generations[table] = _generations.get(table, 0) + 1
+
+
+# Versions of report data are stored in the database, so they're the same for all workers. Writes bump versions
+# of changed entities (e.g. "customer:1") in the same transaction, changes which affect many reports use keys
+# without ids (e.g. "product" when products shown in customer reports change) and ALL_DATA is bumped after changes
+# that can't be scoped (deletes which cascade to orders, raw sql). Writes done directly in the database aren't seen.
+ALL_DATA = "*"
+
+
+def version_key(model: Type[Model], entity_id: Optional[int] = None) -> str:
+    table = model._meta.db_table
+    return table if entity_id is None else f"{table}:{entity_id}"
+
+
+# Keys are sorted, so concurrent transactions lock version rows in the same order.
+async def bump_versions(*keys: str, using_db: Optional[BaseDBAsyncClient] = None) -> None:
+    if not (keys := sorted(set(keys))):
+        return
+    query = (
+        f"INSERT INTO dataversion (name, version) VALUES {', '.join(['(%s, 1)'] * len(keys))} "
+        "ON DUPLICATE KEY UPDATE version = version + 1;"
+    )
+    await (using_db or connections.get("default")).execute_query(query, keys)
+
+
+async def data_version(*keys: str) -> str:
+    versions = dict(await DataVersion.filter(name__in=[ALL_DATA, *keys]).values_list("name", "version"))
+    return ".".join(str(versions.get(key, 0)) for key in (ALL_DATA, *keys))
+
+
+async def estimated_count(model: Type[Model]) -> Optional[int]:
+    conn = connections.get("default")
+    query = "SELECT TABLE_ROWS AS count FROM information_schema.TABLES WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s;"
+    result = await conn.execute_query_dict(query, [model._meta.db_table])
+    if not result or result[0]["count"] is None:
+        return None
+    return int(result[0]["count"])
+
+
+# Counts rows matched by (not limited) query. Counts are cached by generated sql until the model (or a model it
+# references) is invalidated or COUNT_TTL passes. With estimate=True counts of unfiltered queries are read from
+# table statistics instead.
+async def cached_count(query: QuerySet, estimate: bool = False) -> int:
+    model = query.model
+    count_query = query.count()
+    sql = count_query.sql()
+    if estimate and sql == model.all().count().sql() and (count := await estimated_count(model)) is not None:
+        return count
+
+    gen = count_generation(model)
+    if (cached := _counts.get(sql)) is not None:
+        cached_gen, count, expires_at = cached
+        if cached_gen == gen and expires_at > monotonic():
+            _counts.move_to_end(sql)
+            return count
+
+    count = await count_query
+    _counts[sql] = (gen, count, monotonic() + COUNT_TTL)
+    _counts.move_to_end(sql)
+    while len(_counts) > COUNT_CACHE_SIZE:
+        _counts.popitem(last=False)
+
+    return count
+
+
+# Rendered reports keyed by their version, saved to REPORT_CACHE_DIR so big reports aren't kept in memory.
+# Files aren't removed when entries are evicted (they may be being sent), instead files which weren't used for
+# REPORT_CACHE_TTL seconds are removed periodically, files of cached entries are touched on every hit.
+# REPORT_CACHE_DIR is shared by all workers, this also removes files left by stopped workers.
+class ReportCache:
+    entries: OrderedDict[str, tuple[str, str, Optional[str]]] = OrderedDict()
+    cleaned_at = 0.0
+
+    @classmethod
+    def remove_old_files(cls) -> None:
+        cls.cleaned_at = time()
+        if not os.path.isdir(REPORT_CACHE_DIR):
+            return
+        for name in os.listdir(REPORT_CACHE_DIR):
+            path = os.path.join(REPORT_CACHE_DIR, name)
+            try:
+                if name.endswith((".json", ".xlsx")) and os.path.getmtime(path) + REPORT_CACHE_TTL < cls.cleaned_at:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _write_json(path: str, report: dict) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(jsonable_encoder(report), f, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+    # Returns (path, media type, filename) of the cached report.
+    @classmethod
+    def get(cls, key: str) -> Optional[tuple[str, str, Optional[str]]]:
+        if (entry := cls.entries.get(key)) is None:
+            return None
+        try:
+            os.utime(entry[0])
+        except OSError:
+            del cls.entries[key]
+            return None
+
+        cls.entries.move_to_end(key)
+        return entry
+
+    @classmethod
+    async def put(cls, key: str, report: dict | XlsxWriter) -> tuple[str, str, Optional[str]]:
+        os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+        if isinstance(report, XlsxWriter):
+            path = os.path.join(REPORT_CACHE_DIR, f"{uuid4().hex}.xlsx")
+            await run_in_threadpool(report.save, path)
+            entry = (path, XLSX_MEDIA_TYPE, report.filename)
+        else:
+            path = os.path.join(REPORT_CACHE_DIR, f"{uuid4().hex}.json")
+            await run_in_threadpool(cls._write_json, path, report)
+            entry = (path, "application/json", None)
+
+        cls.entries[key] = entry
+        while len(cls.entries) > REPORT_CACHE_SIZE:
+            cls.entries.popitem(last=False)
+        if cls.cleaned_at + REPORT_CLEANUP_INTERVAL < time():
+            await run_in_threadpool(cls.remove_old_files)
+
+        return entry
@@ -0,0 +1,52 @@
+import csv
+from datetime import datetime, date
+from io import StringIO
+from typing import Any, AsyncIterator, Type
+
+from fastapi.responses import StreamingResponse
+from tortoise.queryset import QuerySet
+
+from app.models._utils import Model
+from app.schemas import SearchData, ExportFormat
+from app.utils import search, iter_chunks
+from app.xlsx import XlsxWriter, StyledValue
+
+
+def export_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+async def iter_csv(query: QuerySet, orderings: list[str], columns: list[str]) -> AsyncIterator[str]:
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue()
+
+    async for rows in iter_chunks(query, orderings):
+        buf.seek(0)
+        buf.truncate()
+        for row in rows:
+            writer.writerow([export_value(getattr(row, column)) for column in columns])
+        yield buf.getvalue()
+
+
+# Exports all rows matched by the search (pagination is ignored). Rows are read in keyset-based chunks,
+# csv is streamed while reading, excel rows are spooled to a temporary file by XlsxWriter.
+async def export_search(model: Type[Model], data: SearchData, fmt: ExportFormat) -> StreamingResponse:
+    query, orderings = search(model, data)
+    columns = list(model._meta.fields_db_projection)
+    filename = f"{model._meta.db_table}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+
+    if fmt == "csv":
+        return StreamingResponse(iter_csv(query, orderings, columns), media_type="text/csv",
+                                 headers={"Content-Disposition": f"attachment; filename=\"{filename}\""})
+
+    writer = XlsxWriter(filename)
+    writer.append([StyledValue(column, bold=True) for column in columns])
+    async for rows in iter_chunks(query, orderings):
+        for row in rows:
+            writer.append([getattr(row, column) for column in columns])
+
+    return await writer.response()
@@ -0,0 +1,105 @@
+import math
+from typing import Any, Optional
+
+from tortoise import connections
+from tortoise.expressions import Subquery
+from tortoise.functions import Count, Min, Max
+from tortoise.queryset import QuerySet
+
+from app.migrations import advisory_lock, column_exists
+from app.models import ProductCharacteristic, Characteristic
+from app.schemas.products import FacetFilter
+from app.utils import iter_chunks
+
+FACET_VALUES_LIMIT = 50
+
+
+# Characteristic values are stored as text, normalized copy (value_key) is used for equality filters
+# and facet values, numeric values are also stored in value_number for range filters.
+def typed_value(value: Any) -> dict:
+    value = str(int(value)) if isinstance(value, bool) else str(value)
+    key = value.strip().lower()[:255]
+    try:
+        number = float(key)
+    except ValueError:
+        number = None
+    if number is not None and not math.isfinite(number):
+        number = None
+
+    return {"value": value, "value_key": key, "value_number": number}
+
+
+# generate_schemas doesn't change existing tables, so typed value columns are added on startup if missing.
+async def backfill_typed_values() -> None:
+    async with advisory_lock("cw_typed_values"):
+        if not await column_exists(ProductCharacteristic, "value_key"):
+            await connections.get("default").execute_query(
+                "ALTER TABLE productcharacteristic ADD value_key VARCHAR(255) NULL, ADD value_number DOUBLE NULL, "
+                "ADD INDEX idx_productchar_value_key (characteristic_id, value_key, product_id), "
+                "ADD INDEX idx_productchar_value_number (characteristic_id, value_number, product_id);"
+            )
+
+        async for chars in iter_chunks(ProductCharacteristic.filter(value_key__isnull=True)):
+            for char in chars:
+                values = typed_value(char.value)
+                char.value_key, char.value_number = values["value_key"], values["value_number"]
+            await ProductCharacteristic.bulk_update(chars, fields=["value_key", "value_number"])
+
+
+def filter_products(query: QuerySet, filters: list[FacetFilter]) -> QuerySet:
+    for facet_filter in filters:
+        chars = ProductCharacteristic.filter(characteristic_id=facet_filter.characteristic_id)
+        if facet_filter.values is not None:
+            chars = chars.filter(value_key__in=[typed_value(value)["value_key"] for value in facet_filter.values])
+        if facet_filter.min is not None:
+            chars = chars.filter(value_number__gte=facet_filter.min)
+        if facet_filter.max is not None:
+            chars = chars.filter(value_number__lte=facet_filter.max)
+        query = query.filter(id__in=Subquery(chars.values("product_id")))
+
+    return query
+
+
+async def count_facets(products: QuerySet, characteristic_ids: list[int]) -> dict[int, dict]:
+    facets = {char_id: {"values": [], "min": None, "max": None} for char_id in characteristic_ids}
+    if not facets:
+        return facets
+
+    rows = await ProductCharacteristic \
+        .filter(characteristic_id__in=characteristic_ids, product_id__in=Subquery(products.values("id"))) \
+        .annotate(count=Count("id"), label=Min("value"), min=Min("value_number"), max=Max("value_number")) \
+        .group_by("characteristic_id", "value_key") \
+        .values("characteristic_id", "value_key", "count", "label", "min", "max")
+
+    for row in rows:
+        facet = facets[row["characteristic_id"]]
+        facet["values"].append({"value": row["value_key"], "label": row["label"].strip(), "count": row["count"]})
+        if row["min"] is not None:
+            facet["min"] = row["min"] if facet["min"] is None else min(facet["min"], row["min"])
+            facet["max"] = row["max"] if facet["max"] is None else max(facet["max"], row["max"])
+
+    for facet in facets.values():
+        facet["values"] = sorted(facet["values"], key=lambda value: -value["count"])[:FACET_VALUES_LIMIT]
+
+    return facets
+
+
+# Values of a facet are counted among products matched by all filters except filters of the same characteristic,
+# so other values of already filtered characteristics are still shown with their counts.
+async def product_facets(base: QuerySet, filters: list[FacetFilter], characteristic_ids: Optional[list[int]]) -> list:
+    query = filter_products(base, filters)
+    filtered = {facet_filter.characteristic_id for facet_filter in filters}
+    if characteristic_ids is None:
+        characteristic_ids = await ProductCharacteristic.filter(product_id__in=Subquery(query.values("id"))) \
+            .distinct().values_list("characteristic_id", flat=True)
+        characteristic_ids = sorted(set(characteristic_ids) | filtered)
+
+    facets = await count_facets(query, [char_id for char_id in characteristic_ids if char_id not in filtered])
+    for char_id in characteristic_ids:
+        if char_id in filtered:
+            other_filters = [facet_filter for facet_filter in filters if facet_filter.characteristic_id != char_id]
+            facets |= await count_facets(filter_products(base, other_filters), [char_id])
+
+    chars = {char.id: char for char in await Characteristic.filter(id__in=characteristic_ids)}
+    return [{"id": char_id, "name": chars[char_id].name, "unit": chars[char_id].measurement_unit, **facets[char_id]}
+            for char_id in characteristic_ids if char_id in chars]
@@ -0,0 +1,48 @@
+import re
+from typing import Type, Callable
+
+from pypika.terms import ValueWrapper
+from tortoise import connections
+from tortoise.contrib.mysql.search import SearchCriterion, Mode
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
+
+from app.migrations import advisory_lock, index_exists
+from app.models import Product, Customer
+from app.models._utils import Model
+
+FULLTEXT_INDEXES = {
+    Product: ("model", "manufacturer"),
+    Customer: ("first_name", "last_name", "email"),
+}
+MIN_TOKEN_SIZE = 3  # innodb_ft_min_token_size
+TOKEN_RE = re.compile(r"\w+")
+
+
+def index_name(model: Type[Model]) -> str:
+    return f"ft_{model._meta.db_table}_search"
+
+
+# generate_schemas doesn't change existing tables, so fulltext indexes are created on startup if missing.
+async def ensure_fulltext_indexes() -> None:
+    conn = connections.get("default")
+    async with advisory_lock("cw_fulltext_indexes"):
+        for model, fields in FULLTEXT_INDEXES.items():
+            table, name = model._meta.db_table, index_name(model)
+            if await index_exists(model, name):
+                continue
+            columns = ", ".join(f"`{field}`" for field in fields)
+            await conn.execute_query(f"ALTER TABLE `{table}` ADD FULLTEXT INDEX `{name}` ({columns});")
+
+
+# Every word of the text must match a word prefix, results are ranked by relevance. Words shorter than
+# MIN_TOKEN_SIZE are not indexed, so such texts are searched with the fallback filter.
+def fulltext_search(model: Type[Model], text: str, fallback: Callable[[str], Q]) -> tuple[QuerySet, list[str]]:
+    tokens = TOKEN_RE.findall(text)
+    if not tokens or any(len(token) < MIN_TOKEN_SIZE for token in tokens):
+        return model.filter(fallback(text)), ["id"]
+
+    table = model._meta.basetable
+    match = SearchCriterion(*(table.field(field) for field in FULLTEXT_INDEXES[model]),
+                            expr=ValueWrapper(" ".join(f"+{token}*" for token in tokens)), mode=Mode.BOOL_MODE)
+    return model.annotate(relevance=match).filter(relevance__gt=0), ["-relevance", "id"]
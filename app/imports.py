@@ -0,0 +1,252 @@
+import csv
+import json
+import os
+from datetime import date, datetime
+from io import TextIOWrapper
+from itertools import islice
+from tempfile import TemporaryFile
+from typing import IO, Any, Iterator, Optional, AsyncIterator, Type
+from zipfile import BadZipFile
+
+from fastapi import Request, HTTPException
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.exceptions import OperationalError, IntegrityError
+from tortoise.transactions import in_transaction
+
+from app.cache import invalidate, bump_versions, ALL_DATA
+from app.facets import typed_value
+from app.models import Product, Category, Characteristic, ProductCharacteristic
+from app.models._utils import Model
+from app.schemas.products import ProductImportRow, ImportFormat
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", 200 * 1024 * 1024))
+PRODUCT_COLUMNS = ("model", "manufacturer", "price", "quantity", "per_order_limit", "image_url", "warranty_days",
+                   "category")
+CHAR_PREFIX = "char:"
+
+
+# Request body is saved to a temporary file, so parsers can read it without keeping the whole file in memory.
+async def spool_body(request: Request) -> IO[bytes]:
+    fp = TemporaryFile()
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > IMPORT_MAX_BYTES:
+            fp.close()
+            raise HTTPException(status_code=413, detail="File is too big!")
+        fp.write(chunk)
+
+    fp.seek(0)
+    return fp
+
+
+def read_csv(fp: IO[bytes]) -> Iterator[list]:
+    yield from csv.reader(TextIOWrapper(fp, encoding="utf-8-sig", newline=""))
+
+
+def read_xlsx(fp: IO[bytes]) -> Iterator[tuple]:
+    wb = load_workbook(fp, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def cell_text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    value = str(value).strip()
+    return value or None
+
+
+# Products are matched by (manufacturer, model), existing products are updated with non-empty cells of the row,
+# other rows create new products. Columns named "char:<name>" set characteristic values, missing categories and
+# characteristics are created. Every chunk of IMPORT_CHUNK_SIZE rows is saved in its own transaction.
+class ProductImport:
+    def __init__(self, fp: IO[bytes], fmt: ImportFormat):
+        self.fp = fp
+        self.rows = read_csv(fp) if fmt == "csv" else read_xlsx(fp)
+        self.columns: list[Optional[tuple[str, str]]] = []
+        self.row_number = 1
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+
+    def _next_rows(self, count: int) -> list:
+        return list(islice(self.rows, count))
+
+    async def open(self) -> None:
+        try:
+            header = await run_in_threadpool(self._next_rows, 1)
+        except (BadZipFile, InvalidFileException, UnicodeDecodeError, csv.Error):
+            self.fp.close()
+            raise HTTPException(status_code=400, detail="Invalid file!")
+
+        for cell in (header[0] if header else ()):
+            name = cell_text(cell) or ""
+            if name.lower() in PRODUCT_COLUMNS:
+                self.columns.append(("product", name.lower()))
+            elif name.lower().startswith(CHAR_PREFIX) and 0 < len(name[len(CHAR_PREFIX):].strip()) <= 255:
+                self.columns.append(("char", name[len(CHAR_PREFIX):].strip()))
+            else:
+                self.columns.append(None)
+
+        if ("product", "model") not in self.columns or ("product", "manufacturer") not in self.columns:
+            self.fp.close()
+            raise HTTPException(status_code=400, detail="\"model\" and \"manufacturer\" columns are required!")
+
+    def _parse(self, raw_rows: list) -> tuple[list[tuple[int, ProductImportRow, dict]], list[dict]]:
+        rows, errors = [], []
+        for raw in raw_rows:
+            self.row_number += 1
+            product, chars = {}, {}
+            for column, value in zip(self.columns, raw):
+                if column is None or (value := cell_text(value)) is None:
+                    continue
+                (product if column[0] == "product" else chars)[column[1]] = value
+            if not product and not chars:
+                continue
+
+            try:
+                rows.append((self.row_number, ProductImportRow(**product), chars))
+            except ValidationError as e:
+                errors.append({"row": self.row_number, "error": "; ".join(
+                    f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+
+        return rows, errors
+
+    @staticmethod
+    async def _ids_by_name(model: Type[Model], names: list[str], conn: BaseDBAsyncClient) -> dict[str, int]:
+        ids = {}
+        if not names:
+            return ids
+
+        for obj in await model.filter(name__in=names).order_by("-id").using_db(conn):
+            ids[obj.name.lower()] = obj.id
+        missing = {}
+        for name in names:
+            if name.lower() not in ids:
+                missing.setdefault(name.lower(), name)
+        if missing:
+            await model.bulk_create([model(name=name) for name in missing.values()], using_db=conn)
+            for obj in await model.filter(name__in=list(missing.values())).order_by("-id").using_db(conn):
+                ids[obj.name.lower()] = obj.id
+
+        return ids
+
+    async def _save(self, rows: list[tuple[int, ProductImportRow, dict]], errors: list[dict],
+                    conn: BaseDBAsyncClient) -> tuple[int, int]:
+        categories = await self._ids_by_name(Category, [data.category for _, data, _ in rows if data.category], conn)
+        characteristics = await self._ids_by_name(Characteristic, [name for *_, chars in rows for name in chars], conn)
+
+        def key(obj: Product | ProductImportRow) -> tuple[str, str]:
+            return obj.manufacturer.lower(), obj.model.lower()
+
+        models = {data.model for _, data, _ in rows}
+        manufacturers = {data.manufacturer for _, data, _ in rows}
+        keys = {key(data) for _, data, _ in rows}
+        products_query = Product.filter(model__in=models, manufacturer__in=manufacturers).order_by("-id").using_db(conn)
+        existing = {key(product): product for product in await products_query.all() if key(product) in keys}
+
+        new, updated, updated_fields, char_values = {}, set(), set(), {}
+        for row_number, data, chars in rows:
+            values = data.model_dump(exclude_none=True, exclude={"category"})
+            if data.category:
+                values["category_id"] = categories[data.category.lower()]
+
+            if (product := existing.get(key(data)) or new.get(key(data))) is not None:
+                product.update_from_dict(values)
+            elif data.price is None:
+                errors.append({"row": row_number, "error": "price: Field required for new products"})
+                continue
+            else:
+                new[key(data)] = Product(**values)
+
+            if key(data) in existing:
+                updated.add(key(data))
+                updated_fields |= values.keys() - {"model", "manufacturer"}
+            char_values.setdefault(key(data), {}).update(chars)
+
+        if updated and updated_fields:
+            await Product.bulk_update([existing[product_key] for product_key in updated], fields=list(updated_fields),
+                                      using_db=conn)
+        if new:
+            await Product.bulk_create(list(new.values()), using_db=conn)
+
+        ids = {product_key: product.id for product_key, product in existing.items()}
+        if new:
+            for product in await products_query.all():
+                if key(product) in new and key(product) not in ids:
+                    ids[key(product)] = product.id
+
+        values = {(ids[product_key], characteristics[name.lower()]): value
+                  for product_key, chars in char_values.items() for name, value in chars.items()}
+        if values:
+            current = await ProductCharacteristic.filter(product_id__in={product_id for product_id, _ in values},
+                                                         characteristic_id__in={char_id for _, char_id in values}) \
+                .using_db(conn)
+            current = {(char.product_id, char.characteristic_id): char for char in current}
+            to_update, to_create = [], []
+            for (product_id, char_id), value in values.items():
+                if (char := current.get((product_id, char_id))) is not None:
+                    to_update.append(char.update_from_dict(typed_value(value)))
+                else:
+                    to_create.append(ProductCharacteristic(product_id=product_id, characteristic_id=char_id,
+                                                           **typed_value(value)))
+            if to_update:
+                await ProductCharacteristic.bulk_update(to_update, fields=["value", "value_key", "value_number"],
+                                                        using_db=conn)
+            if to_create:
+                await ProductCharacteristic.bulk_create(to_create, using_db=conn)
+
+        return len(new), len(updated)
+
+    async def _import_chunk(self, raw_rows: list) -> list[dict]:
+        first_row = self.row_number + 1
+        rows, errors = self._parse(raw_rows)
+        failed = len(errors)
+        if rows:
+            try:
+                async with in_transaction() as conn:
+                    created, updated = await self._save(rows, errors, conn)
+                    await bump_versions(ALL_DATA, using_db=conn)
+                self.created += created
+                self.updated += updated
+                failed = len(errors)
+            except (OperationalError, IntegrityError):
+                errors = errors[:failed] + [{"rows": [first_row, self.row_number], "error": "Failed to save rows!"}]
+                failed += len(rows)
+            invalidate(Product, Category, Characteristic, ProductCharacteristic)
+
+        self.failed += failed
+        return errors
+
+    def _progress(self, **kwargs) -> str:
+        return json.dumps({
+            "processed": self.row_number - 1,
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            **kwargs,
+        }) + "\n"
+
+    async def progress(self) -> AsyncIterator[str]:
+        try:
+            while raw_rows := await run_in_threadpool(self._next_rows, IMPORT_CHUNK_SIZE):
+                yield self._progress(errors=await self._import_chunk(raw_rows))
+        except (UnicodeDecodeError, csv.Error):
+            yield self._progress(done=False, error="Invalid file!")
+            return
+        finally:
+            self.fp.close()
+
+        yield self._progress(done=True)
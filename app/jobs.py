@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from tempfile import gettempdir
+from time import time
+from typing import Callable, Awaitable, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from app.xlsx import XlsxWriter, XLSX_MEDIA_TYPE
+
+JOBS_DIR = os.environ.get("REPORT_JOBS_DIR", os.path.join(gettempdir(), "cw-report-jobs"))
+JOB_WORKERS = int(os.environ.get("REPORT_JOB_WORKERS", 2))
+JOB_QUEUE_LIMIT = int(os.environ.get("REPORT_JOB_QUEUE_LIMIT", 100))
+JOB_TTL = int(os.environ.get("REPORT_JOB_TTL", 60 * 60))
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+JOB_FILE_RE = re.compile(r"^[0-9a-f]{32}\.(json|xlsx|meta\.json)(\.tmp)?$")
+
+logger = logging.getLogger(__name__)
+
+
+class ReportJob:
+    def __init__(self, manager_id: int, func: Optional[Callable[[], Awaitable[dict | XlsxWriter]]] = None,
+                 id: Optional[str] = None):
+        self.id = id or uuid4().hex
+        self.manager_id = manager_id
+        self.func = func
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time()
+        self.finished_at: Optional[float] = None
+        self.path: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.media_type: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": datetime.fromtimestamp(self.created_at),
+            "finished_at": datetime.fromtimestamp(self.finished_at) if self.finished_at is not None else None,
+        }
+
+    @staticmethod
+    def meta_path(job_id: str) -> str:
+        return os.path.join(JOBS_DIR, f"{job_id}.meta.json")
+
+    # Job state is written next to the result, so any worker (or the same worker after restart) can read it.
+    def save(self) -> None:
+        meta = {
+            "id": self.id,
+            "manager_id": self.manager_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "path": os.path.basename(self.path) if self.path is not None else None,
+            "filename": self.filename,
+            "media_type": self.media_type,
+        }
+        path = self.meta_path(self.id)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, job_id: str) -> Optional["ReportJob"]:
+        if not JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(cls.meta_path(job_id)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        job = cls(meta["manager_id"], id=meta["id"])
+        job.status = meta["status"]
+        job.error = meta["error"]
+        job.created_at = meta["created_at"]
+        job.finished_at = meta["finished_at"]
+        job.path = os.path.join(JOBS_DIR, meta["path"]) if meta["path"] is not None else None
+        job.filename = meta["filename"]
+        job.media_type = meta["media_type"]
+        return job
+
+
+# Reports are generated by JOB_WORKERS worker tasks, so at most JOB_WORKERS reports are built at the same time.
+# Job state and results are saved to JOBS_DIR and removed JOB_TTL seconds after the job is finished.
+# JOBS_DIR is shared by all workers, so jobs can be read by any of them and only expired files are removed from it,
+# files left by stopped (or crashed) workers are removed the same way.
+class ReportJobs:
+    active: dict[str, ReportJob] = {}
+    queue: Optional[asyncio.Queue] = None
+    tasks: list[asyncio.Task] = []
+
+    @classmethod
+    def start(cls) -> None:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        cls._remove_expired_files()
+
+        cls.queue = asyncio.Queue()
+        cls.tasks = [asyncio.create_task(cls._worker()) for _ in range(JOB_WORKERS)]
+        cls.tasks.append(asyncio.create_task(cls._cleanup()))
+
+    @classmethod
+    async def stop(cls) -> None:
+        for task in cls.tasks:
+            task.cancel()
+        await asyncio.gather(*cls.tasks, return_exceptions=True)
+        cls.tasks = []
+        cls.queue = None
+
+        for job in cls.active.values():
+            job.status, job.error = "failed", "Report job was interrupted!"
+            job.finished_at = time()
+            cls._save(job)
+        cls.active = {}
+
+    @classmethod
+    def submit(cls, manager_id: int, func: Callable[[], Awaitable[dict | XlsxWriter]]) -> ReportJob:
+        if cls.queue is None:
+            raise HTTPException(status_code=503, detail="Report jobs are not available!")
+        if cls.queue.qsize() >= JOB_QUEUE_LIMIT:
+            raise HTTPException(status_code=503, detail="Too many report jobs, try again later!")
+
+        job = ReportJob(manager_id, func)
+        job.save()
+        cls.active[job.id] = job
+        cls.queue.put_nowait(job)
+        return job
+
+    @staticmethod
+    def get(job_id: str) -> Optional[ReportJob]:
+        return ReportJob.load(job_id)
+
+    @staticmethod
+    def _save(job: ReportJob) -> None:
+        try:
+            job.save()
+        except OSError:
+            logger.exception("Failed to save report job %s", job.id)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @classmethod
+    def _remove_expired_files(cls) -> None:
+        expired_at = time() - JOB_TTL
+        for name in os.listdir(JOBS_DIR):
+            path = os.path.join(JOBS_DIR, name)
+            try:
+                if JOB_FILE_RE.match(name) and os.path.getmtime(path) < expired_at:
+                    cls._remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _write_json(path: str, result: dict) -> None:
+        with open(path, "w") as f:
+            json.dump(jsonable_encoder(result), f)
+
+    @classmethod
+    async def _run(cls, job: ReportJob) -> None:
+        result = await job.func()
+        if isinstance(result, XlsxWriter):
+            path = os.path.join(JOBS_DIR, f"{job.id}.xlsx")
+            job.filename, job.media_type = result.filename, XLSX_MEDIA_TYPE
+            await run_in_threadpool(result.save, path)
+        else:
+            path = os.path.join(JOBS_DIR, f"{job.id}.json")
+            job.filename, job.media_type = f"report-{job.id}.json", "application/json"
+            await run_in_threadpool(cls._write_json, path, result)
+
+        job.path = path
+
+    @classmethod
+    async def _worker(cls) -> None:
+        while True:
+            job = await cls.queue.get()
+            job.status = "running"
+            cls._save(job)
+            try:
+                await cls._run(job)
+                job.status = "done"
+            except HTTPException as e:
+                job.status, job.error = "failed", e.detail
+            except asyncio.CancelledError:
+                job.status, job.error = "failed", "Report job was interrupted!"
+                raise
+            except Exception:
+                logger.exception("Report job %s failed", job.id)
+                job.status, job.error = "failed", "Failed to generate report!"
+            finally:
+                job.func = None
+                job.finished_at = time()
+                cls.active.pop(job.id, None)
+                cls._save(job)
+                cls.queue.task_done()
+
+    @classmethod
+    async def _cleanup(cls) -> None:
+        while True:
+            await asyncio.sleep(60)
+            cls._remove_expired_files()
@@ -2,8 +2,18 @@ from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 from tortoise.contrib.fastapi import register_tortoise
 
+from app.cache import ReportCache
+from app.facets import backfill_typed_values
+from app.fulltext import ensure_fulltext_indexes
+from app.jobs import ReportJobs
+from app.metrics import MetricsMiddleware, instrument_connections
+from app.recommendations import PriceRecommender
+from app.rollups import load_rollups, RollupRebuilder
 from app.routes import categories, products, orders, managers, customers, auth, characteristics, statistics, reports, \
-    returns, sql
+    returns, sql, metrics
+from app.routes.orders import sync_open_orders
+from app.routes.statistics import ensure_order_time_index
+from app.utils import SessionTokens
 
 app = FastAPI()
 
@@ -14,6 +24,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(products.router)
 app.include_router(categories.router)
@@ -26,6 +37,7 @@ app.include_router(statistics.router)
 app.include_router(reports.router)
 app.include_router(returns.router)
 app.include_router(sql.router)
+app.include_router(metrics.router)
 
 register_tortoise(
     app,
@@ -34,3 +46,68 @@ register_tortoise(
     generate_schemas=True,
     add_exception_handlers=False,
 )
+
+
+@app.on_event("startup")
+async def check_secret_key():
+    SessionTokens.check_key()
+
+
+@app.on_event("startup")
+async def instrument_db_connections():
+    instrument_connections()
+
+
+@app.on_event("startup")
+async def load_manager_counters():
+    await sync_open_orders()
+
+
+@app.on_event("startup")
+async def create_order_time_index():
+    await ensure_order_time_index()
+
+
+@app.on_event("startup")
+async def create_fulltext_indexes():
+    await ensure_fulltext_indexes()
+
+
+@app.on_event("startup")
+async def fill_characteristic_values():
+    await backfill_typed_values()
+
+
+@app.on_event("startup")
+async def load_sales_rollups():
+    await load_rollups()
+
+
+@app.on_event("shutdown")
+async def stop_rollup_rebuilds():
+    await RollupRebuilder.stop()
+
+
+@app.on_event("startup")
+async def remove_old_cached_reports():
+    ReportCache.remove_old_files()
+
+
+@app.on_event("startup")
+async def start_report_jobs():
+    ReportJobs.start()
+
+
+@app.on_event("shutdown")
+async def stop_report_jobs():
+    await ReportJobs.stop()
+
+
+@app.on_event("startup")
+async def start_price_recommender():
+    PriceRecommender.start()
+
+
+@app.on_event("shutdown")
+async def stop_price_recommender():
+    await PriceRecommender.stop()
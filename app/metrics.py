@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Optional, Callable
+
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+from tortoise import connections
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+INSTRUMENTED_METHODS = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count",)
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        result = []
+        total = 0
+        for bucket, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            result.append(f"{name}_bucket{{{labels},le=\"{bucket}\"}} {total}")
+        result.append(f"{name}_sum{{{labels}}} {self.sum}")
+        result.append(f"{name}_count{{{labels}}} {self.count}")
+        return result
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time",)
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Metrics are kept in process memory, every worker process exposes its own values.
+class Metrics:
+    in_flight = 0
+    queries = 0
+    db_time = 0.0
+    requests: dict[tuple[str, str, int], int] = {}
+    durations: dict[tuple[str, str], Histogram] = {}
+    request_queries: dict[tuple[str, str], Histogram] = {}
+    request_db_time: dict[tuple[str, str], Histogram] = {}
+
+    @classmethod
+    def observe_request(cls, method: str, route: str, status: int, duration: float, stats: RequestStats) -> None:
+        key = (method, route)
+        cls.requests[(method, route, status)] = cls.requests.get((method, route, status), 0) + 1
+        cls.durations.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+        cls.request_queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+        cls.request_db_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(stats.db_time)
+
+    @classmethod
+    def observe_query(cls, duration: float) -> None:
+        cls.queries += 1
+        cls.db_time += duration
+        if (stats := request_stats.get()) is not None:
+            stats.queries += 1
+            stats.db_time += duration
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+_in_query: ContextVar[bool] = ContextVar("in_query", default=False)
+
+
+def _instrument(func: Callable) -> Callable:
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        # execute_query_dict (and some other methods) call execute_query, only the outer call is counted
+        if _in_query.get():
+            return await func(*args, **kwargs)
+
+        token = _in_query.set(True)
+        start = perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            Metrics.observe_query(perf_counter() - start)
+            _in_query.reset(token)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+# Wraps query methods of database client classes (including transaction wrappers, which subclass the clients),
+# so queries made through models, querysets and raw sql are all counted.
+def instrument_connections() -> None:
+    classes = [type(conn) for conn in connections.all()]
+    seen = set()
+    while classes:
+        cls = classes.pop()
+        if cls in seen:
+            continue
+        seen.add(cls)
+        classes.extend(cls.__subclasses__())
+        for name in INSTRUMENTED_METHODS:
+            func = cls.__dict__.get(name)
+            if func is not None and not getattr(func, "instrumented", False):
+                setattr(cls, name, _instrument(func))
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        Metrics.in_flight += 1
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = perf_counter() - start
+            Metrics.in_flight -= 1
+            request_stats.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            Metrics.observe_request(scope["method"], route, status, duration, stats)
+
+
+def _labels(**labels) -> str:
+    values = {name: str(value).replace("\\", "\\\\").replace("\"", "\\\"") for name, value in labels.items()}
+    return ",".join(f"{name}=\"{value}\"" for name, value in values.items())
+
+
+def _histograms(name: str, help_: str, histograms: dict[tuple[str, str], Histogram]) -> list[str]:
+    lines = [f"# HELP {name} {help_}", f"# TYPE {name} histogram"]
+    for (method, route), histogram in histograms.items():
+        lines.extend(histogram.lines(name, _labels(method=method, route=route)))
+    return lines
+
+
+def render_metrics(gauges: dict[str, tuple[str, float]]) -> str:
+    lines = [
+        "# HELP http_requests_in_flight Requests currently being processed.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {Metrics.in_flight}",
+        "# HELP http_requests_total Processed requests.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), count in Metrics.requests.items():
+        lines.append(f"http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+
+    lines += _histograms("http_request_duration_seconds", "Request latency.", Metrics.durations)
+    lines += _histograms("http_request_db_queries", "Database queries per request.", Metrics.request_queries)
+    lines += _histograms("http_request_db_seconds", "Time spent in database queries per request.",
+                         Metrics.request_db_time)
+    lines += [
+        "# HELP db_queries_total Database queries (including queries made outside of requests).",
+        "# TYPE db_queries_total counter",
+        f"db_queries_total {Metrics.queries}",
+        "# HELP db_query_seconds_total Time spent in database queries.",
+        "# TYPE db_query_seconds_total counter",
+        f"db_query_seconds_total {Metrics.db_time}",
+    ]
+    for name, (help_, value) in gauges.items():
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+    return "\n".join(lines) + "\n"
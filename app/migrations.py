@@ -0,0 +1,48 @@
+from contextlib import asynccontextmanager
+from typing import Type, AsyncIterator
+
+from tortoise import connections
+
+from app.models._utils import Model
+
+LOCK_TIMEOUT = 600
+
+
+# MySQL named lock held for the duration of the block, used to run startup schema changes and rebuilds only in
+# one worker at a time. Other workers wait for the lock, so they don't start serving before the change is done.
+@asynccontextmanager
+async def advisory_lock(name: str, timeout: int = LOCK_TIMEOUT) -> AsyncIterator[None]:
+    async with connections.get("default").acquire_connection() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute("SELECT GET_LOCK(%s, %s);", (name, timeout))
+            if (await cursor.fetchone())[0] != 1:
+                raise RuntimeError(f"Failed to acquire \"{name}\" lock in {timeout} seconds!")
+            try:
+                yield
+            finally:
+                await cursor.execute("SELECT RELEASE_LOCK(%s);", (name,))
+
+
+async def column_exists(model: Type[Model], column: str) -> bool:
+    query = (
+        "SELECT 1 FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s LIMIT 1;"
+    )
+    return bool(await connections.get("default").execute_query_dict(query, [model._meta.db_table, column]))
+
+
+async def index_exists(model: Type[Model], name: str) -> bool:
+    query = (
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND INDEX_NAME=%s LIMIT 1;"
+    )
+    return bool(await connections.get("default").execute_query_dict(query, [model._meta.db_table, name]))
+
+
+# Index names generated by tortoise are hashed, so indexes created for index=True fields are looked up by column.
+async def column_indexed(model: Type[Model], column: str) -> bool:
+    query = (
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s AND SEQ_IN_INDEX=1 LIMIT 1;"
+    )
+    return bool(await connections.get("default").execute_query_dict(query, [model._meta.db_table, column]))
@@ -8,3 +8,7 @@ from .order_item import OrderItem
 from .characteristic import Characteristic
 from .product_characteristic import ProductCharacteristic
 from .return_ import Return
+from .daily_sales import DailySales
+from .price_recommendation import PriceRecommendation
+from .customer_stats import CustomerStats, CustomerSpendDay
+from .data_version import DataVersion
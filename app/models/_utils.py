@@ -1,7 +1,10 @@
+from typing import Optional
+
 import tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
 
 
 class Model(tortoise.Model):
-    async def update(self, **kwargs) -> None:
+    async def update(self, using_db: Optional[BaseDBAsyncClient] = None, **kwargs) -> None:
         await self.update_from_dict(kwargs)
-        await self.save()
+        await self.save(using_db=using_db)
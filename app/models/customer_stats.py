@@ -0,0 +1,28 @@
+from datetime import date
+
+from tortoise import fields
+
+from app import models
+from app.models._utils import Model
+
+
+class CustomerStats(Model):
+    id: int = fields.BigIntField(pk=True)
+    customer: models.Customer = fields.OneToOneField("models.Customer", on_delete=fields.CASCADE)
+    order_items: int = fields.IntField(default=0)
+    total_money: float = fields.FloatField(default=0, index=True)
+
+    class Meta:
+        indexes = (("order_items", "total_money"),)
+
+
+class CustomerSpendDay(Model):
+    id: int = fields.BigIntField(pk=True)
+    customer: models.Customer = fields.ForeignKeyField("models.Customer", on_delete=fields.CASCADE)
+    day: date = fields.DateField()
+    order_items: int = fields.IntField(default=0)
+    total_money: float = fields.FloatField(default=0)
+
+    class Meta:
+        unique_together = (("customer", "day"),)
+        indexes = (("day", "customer"),)
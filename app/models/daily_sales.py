@@ -0,0 +1,16 @@
+from datetime import date
+
+from tortoise import fields
+
+from app.models._utils import Model
+
+
+class DailySales(Model):
+    id: int = fields.BigIntField(pk=True)
+    day: date = fields.DateField(unique=True)
+    order_count: int = fields.IntField(default=0)
+    item_count: int = fields.IntField(default=0)
+    total_money: float = fields.FloatField(default=0)
+    return_count: int = fields.IntField(default=0)
+    returned_items: int = fields.IntField(default=0)
+    returned_money: float = fields.FloatField(default=0)
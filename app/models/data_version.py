@@ -0,0 +1,8 @@
+from tortoise import fields
+
+from app.models._utils import Model
+
+
+class DataVersion(Model):
+    name: str = fields.CharField(max_length=64, pk=True)
+    version: int = fields.BigIntField(default=0)
@@ -11,9 +11,10 @@ class Manager(Model):
     email: str = fields.CharField(max_length=256)
     password: str = fields.CharField(max_length=256)
     permissions: int = fields.IntField(default=2)
+    open_orders: int = fields.IntField(default=0, index=True)
 
     class PydanticMeta:
-        exclude = ["password"]
+        exclude = ["password", "open_orders"]
 
 
 ManagerPd = pydantic_model_creator(Manager, name="ManagerPd")
@@ -7,6 +7,14 @@ from app import models
 from app.models._utils import Model
 
 
+CLOSED_STATUSES = ("completed", "delivered", "cancelled", "canceled", "returned")
+
+
+# Statuses are compared case-insensitively, same as in sql (see sync_open_orders).
+def is_open(status: str) -> bool:
+    return status.lower() not in CLOSED_STATUSES
+
+
 def dt():
     return datetime.now() - timedelta(days=6)
 
@@ -14,7 +22,7 @@ def dt():
 class Order(Model):
     id: int = fields.BigIntField(pk=True)
     status: str = fields.CharField(max_length=64)
-    creation_time: datetime = fields.DatetimeField(default=dt)
+    creation_time: datetime = fields.DatetimeField(default=dt, index=True)
     address: str = fields.TextField()
     type: str = fields.CharField(max_length=64)
     customer: models.Customer = fields.ForeignKeyField("models.Customer")
@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Optional
+
+from tortoise import fields
+
+from app import models
+from app.models._utils import Model
+
+
+class PriceRecommendation(Model):
+    id: int = fields.BigIntField(pk=True)
+    interval: int = fields.IntField()
+    product: models.Product = fields.ForeignKeyField("models.Product", on_delete=fields.CASCADE)
+    price: float = fields.FloatField()
+    buy_change: float = fields.FloatField()
+    return_change: float = fields.FloatField()
+    coef: float = fields.FloatField()
+    action: Optional[str] = fields.CharField(max_length=8, null=True)
+    recommended_price: Optional[float] = fields.FloatField(null=True)
+    calculated_at: datetime = fields.DatetimeField(default=datetime.now)
+
+    class Meta:
+        unique_together = (("interval", "product"),)
+        indexes = (("interval", "action"),)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from tortoise import fields
 from tortoise.contrib.pydantic import pydantic_model_creator
 
@@ -10,9 +12,14 @@ class ProductCharacteristic(Model):
     product: models.Product = fields.ForeignKeyField("models.Product")
     characteristic: models.Characteristic = fields.ForeignKeyField("models.Characteristic")
     value: str = fields.TextField()
+    value_key: Optional[str] = fields.CharField(max_length=255, null=True)
+    value_number: Optional[float] = fields.FloatField(null=True)
+
+    class Meta:
+        indexes = (("characteristic", "value_key", "product"), ("characteristic", "value_number", "product"))
 
     class PydanticMeta:
-        exclude = ["id", "product", "characteristic"]
+        exclude = ["id", "product", "characteristic", "value_key", "value_number"]
 
 
 ProductCharacteristicPd = pydantic_model_creator(ProductCharacteristic, name="ProductCharacteristicPd")
@@ -0,0 +1,51 @@
+import os
+from asyncio import Semaphore, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from bcrypt import hashpw, gensalt, checkpw
+from fastapi import HTTPException
+
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", 4))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", 64))
+
+T = TypeVar("T")
+
+
+# Bcrypt releases gil, so hashing is done in a small thread pool instead of the event loop.
+# Requests waiting for a free worker are counted in "waiting", new requests are rejected when there are too many.
+class PasswordHasher:
+    executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    semaphore = Semaphore(HASH_WORKERS)
+    waiting = 0
+    running = 0
+
+    @classmethod
+    async def run(cls, func: Callable[..., T], *args) -> T:
+        if cls.waiting >= HASH_QUEUE_LIMIT:
+            raise HTTPException(status_code=503, detail="Too many requests, try again later!")
+
+        cls.waiting += 1
+        try:
+            await cls.semaphore.acquire()
+        finally:
+            cls.waiting -= 1
+
+        cls.running += 1
+        try:
+            return await get_running_loop().run_in_executor(cls.executor, func, *args)
+        finally:
+            cls.running -= 1
+            cls.semaphore.release()
+
+
+def _password_bytes(password: str) -> bytes:
+    return password.encode().replace(b"\x00", b"")
+
+
+async def hash_password(password: str) -> str:
+    return (await PasswordHasher.run(hashpw, _password_bytes(password), gensalt())).decode()
+
+
+async def check_password(password: str, hashed: str) -> bool:
+    return await PasswordHasher.run(checkpw, _password_bytes(password), hashed.encode())
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
+from app.cache import invalidate
+from app.migrations import advisory_lock
+from app.models import PriceRecommendation
+
+DEFAULT_INTERVAL = 2
+RECOMMENDATIONS_PERIOD = int(os.environ.get("PRICE_RECOMMENDATIONS_PERIOD", 60 * 60))
+MIN_DAYS = 3
+MIN_COEF = 0.25
+
+logger = logging.getLogger(__name__)
+
+
+async def load_sales(interval: int) -> dict[str, np.ndarray]:
+    conn = connections.get("default")
+    query = (
+        "SELECT product.id, product.price, DATE(`order`.creation_time) AS day, COUNT(orderitem.id) AS items, "
+        "SUM(COALESCE(`return`.quantity, 0)) AS returns "
+        "FROM product "
+        "INNER JOIN orderitem ON product.id = orderitem.product_id "
+        "INNER JOIN `order` ON orderitem.order_id = `order`.id "
+        "LEFT JOIN `return` ON orderitem.id = `return`.order_item_id "
+        "WHERE `order`.creation_time > NOW() - INTERVAL %s WEEK "
+        "GROUP BY product.id, product.price, day "
+        "ORDER BY product.id, day;"
+    )
+    rows = await conn.execute_query_dict(query, [interval])
+    return {
+        "ids": np.fromiter((row["id"] for row in rows), dtype=np.int64, count=len(rows)),
+        "prices": np.fromiter((row["price"] for row in rows), dtype=np.float64, count=len(rows)),
+        "items": np.fromiter((row["items"] for row in rows), dtype=np.float64, count=len(rows)),
+        "returns": np.fromiter((row["returns"] for row in rows), dtype=np.float64, count=len(rows)),
+    }
+
+
+# Average relative change between consecutive non-zero values of each group (rows of a group must be adjacent).
+def mean_changes(groups: np.ndarray, values: np.ndarray, group_count: int) -> np.ndarray:
+    mask = values > 0
+    groups, values = groups[mask], values[mask]
+    pairs = groups[1:] == groups[:-1]
+    changes = (values[1:][pairs] - values[:-1][pairs]) / values[:-1][pairs]
+    totals = np.bincount(groups[1:][pairs], weights=changes, minlength=group_count)
+    counts = np.bincount(groups[1:][pairs], minlength=group_count)
+    return np.divide(totals, counts, out=np.zeros(group_count), where=counts > 0)
+
+
+# Products sold on less than MIN_DAYS days, with the same sales every day, or with small buy/return trend
+# are returned with action=None.
+def compute_recommendations(sales: dict[str, np.ndarray]) -> list[dict]:
+    product_ids, first, groups, days = np.unique(sales["ids"], return_index=True, return_inverse=True,
+                                                 return_counts=True)
+    count = len(product_ids)
+    items, returns = sales["items"], sales["returns"]
+
+    changed_rows = (items != items[first][groups]) | (returns != returns[first][groups])
+    changed = np.bincount(groups, weights=changed_rows, minlength=count) > 0
+    buy = mean_changes(groups, items, count)
+    ret = -mean_changes(groups, returns, count)
+    coef = buy * 1.2 + ret * 0.7
+
+    prices = sales["prices"][first]
+    price_coef = np.abs(np.minimum(coef - MIN_COEF, 0.5) / 10)
+    recommended = np.where(coef < 0, prices * (1 - price_coef), prices * (1 + price_coef))
+    selected = (days >= MIN_DAYS) & changed & (np.abs(coef) >= MIN_COEF)
+
+    return [{
+        "product_id": int(product_ids[i]),
+        "price": float(prices[i]),
+        "buy_change": float(buy[i]),
+        "return_change": float(ret[i]),
+        "coef": float(coef[i]),
+        "action": ("down" if coef[i] < 0 else "up") if selected[i] else None,
+        # np.round rounds scaled values, which differs from round() on some halves (e.g. 1.615)
+        "recommended_price": round(float(recommended[i]), 2) if selected[i] else None,
+    } for i in range(count)]
+
+
+async def calculate_recommendations(interval: int) -> list[dict]:
+    return await run_in_threadpool(compute_recommendations, await load_sales(interval))
+
+
+# Recommendations for DEFAULT_INTERVAL are recalculated every RECOMMENDATIONS_PERIOD seconds and stored in
+# pricerecommendation table, so the endpoint doesn't need to analyze sales on every request. Every worker runs
+# the refresh loop, but recommendations are recalculated by one worker at a time and skipped if other worker
+# has already stored fresh ones.
+class PriceRecommender:
+    task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def refresh(interval: int = DEFAULT_INTERVAL) -> None:
+        async with advisory_lock(f"cw_price_recommendations_{interval}"):
+            fresh_after = datetime.now() - timedelta(seconds=RECOMMENDATIONS_PERIOD)
+            if await PriceRecommendation.filter(interval=interval, calculated_at__gt=fresh_after).exists():
+                return
+
+            recommendations = await calculate_recommendations(interval)
+            async with in_transaction() as conn:
+                await PriceRecommendation.filter(interval=interval).using_db(conn).delete()
+                await PriceRecommendation.bulk_create([PriceRecommendation(interval=interval, **rec)
+                                                       for rec in recommendations], batch_size=1000, using_db=conn)
+        invalidate(PriceRecommendation)
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            try:
+                await cls.refresh()
+            except Exception:
+                logger.exception("Failed to refresh price recommendations")
+            await asyncio.sleep(RECOMMENDATIONS_PERIOD)
+
+    @classmethod
+    def start(cls) -> None:
+        cls.task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls.task is not None:
+            cls.task.cancel()
+            await asyncio.gather(cls.task, return_exceptions=True)
+            cls.task = None
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from typing import Optional
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from app.migrations import advisory_lock
+from app.models import DailySales, OrderItem, Return, Order, CustomerStats, CustomerSpendDay
+
+logger = logging.getLogger(__name__)
+
+
+async def add_counters(conn: BaseDBAsyncClient, table: str, keys: dict, **deltas: int | float) -> None:
+    columns = [*keys, *deltas]
+    query = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{column} = {column} + %s' for column in deltas)};"
+    )
+    await conn.execute_query(query, [*keys.values(), *deltas.values(), *deltas.values()])
+
+
+async def add_customer_spend(conn: BaseDBAsyncClient, order: Order, **deltas: int | float) -> None:
+    await add_counters(conn, "customerstats", {"customer_id": order.customer_id}, **deltas)
+    await add_counters(conn, "customerspendday", {"customer_id": order.customer_id,
+                                                  "day": order.creation_time.date()}, **deltas)
+
+
+# Orders without items are not counted, same as in time statistics which were computed from orders joined
+# with their items.
+async def record_order(conn: BaseDBAsyncClient, order: Order, items: list[OrderItem]) -> None:
+    if not items:
+        return
+
+    total_money = sum(item.price * item.quantity for item in items)
+    await add_counters(conn, "dailysales", {"day": order.creation_time.date()}, order_count=1,
+                       item_count=sum(item.quantity for item in items), total_money=total_money)
+    await add_customer_spend(conn, order, order_items=len(items), total_money=total_money)
+
+
+# return_.order and return_.order_item must be fetched. Returned money is subtracted from customer spend
+# on the day of the order, so rolling windows contain net spend of orders made in the window.
+async def record_return(conn: BaseDBAsyncClient, return_: Return, quantity_diff: int, new: bool) -> None:
+    money = quantity_diff * return_.order_item.price
+    await add_counters(conn, "dailysales", {"day": return_.creation_time.date()}, return_count=int(new),
+                       returned_items=quantity_diff, returned_money=money)
+    await add_customer_spend(conn, return_.order, total_money=-money)
+
+
+async def rebuild_daily_sales() -> None:
+    conn = connections.get("default")
+    query = (
+        "INSERT INTO dailysales (day, order_count, item_count, total_money, return_count, returned_items, "
+        "returned_money) "
+        "SELECT sales.day, SUM(sales.orders), SUM(sales.items), SUM(sales.money), SUM(sales.returns), "
+        "SUM(sales.returned_items), SUM(sales.returned_money) FROM ("
+        "    SELECT DATE(`order`.creation_time) AS day, COUNT(DISTINCT `order`.id) AS orders, "
+        "    SUM(orderitem.quantity) AS items, SUM(orderitem.price * orderitem.quantity) AS money, "
+        "    0 AS returns, 0 AS returned_items, 0 AS returned_money "
+        "    FROM `order` INNER JOIN orderitem ON orderitem.order_id = `order`.id "
+        "    GROUP BY DATE(`order`.creation_time) "
+        "    UNION ALL "
+        "    SELECT DATE(`return`.creation_time), 0, 0, 0, COUNT(*), SUM(`return`.quantity), "
+        "    SUM(`return`.quantity * orderitem.price) "
+        "    FROM `return` INNER JOIN orderitem ON orderitem.id = `return`.order_item_id "
+        "    GROUP BY DATE(`return`.creation_time)"
+        ") sales GROUP BY sales.day;"
+    )
+    await conn.execute_query(query)
+
+
+async def rebuild_customer_spend() -> None:
+    conn = connections.get("default")
+    spend = (
+        "SELECT `order`.customer_id, DATE(`order`.creation_time) AS day, COUNT(orderitem.id) AS order_items, "
+        "SUM(orderitem.price * (orderitem.quantity - COALESCE(`return`.quantity, 0))) AS total_money "
+        "FROM `order` "
+        "INNER JOIN orderitem ON orderitem.order_id = `order`.id "
+        "LEFT JOIN `return` ON `return`.order_item_id = orderitem.id "
+        "GROUP BY `order`.customer_id, day"
+    )
+    await conn.execute_query(f"INSERT INTO customerspendday (customer_id, day, order_items, total_money) {spend};")
+    await conn.execute_query(
+        "INSERT INTO customerstats (customer_id, order_items, total_money) "
+        "SELECT customer_id, SUM(order_items), SUM(total_money) FROM customerspendday GROUP BY customer_id;"
+    )
+
+
+# Rollups are rebuilt only if they are empty (e.g. on the first start). Workers starting at the same time wait
+# for the one which rebuilds them, so they neither insert the same rows twice nor serve incomplete rollups.
+async def load_rollups() -> None:
+    async with advisory_lock("cw_rollups"):
+        if not await DailySales.exists():
+            await rebuild_daily_sales()
+        if not await CustomerStats.exists() and not await CustomerSpendDay.exists():
+            await rebuild_customer_spend()
+
+
+# Rollups are replaced in one transaction, so statistics are read from the old rollups until the rebuild is done.
+async def rebuild_rollups() -> None:
+    async with advisory_lock("cw_rollups"):
+        async with in_transaction() as conn:
+            for table in ("dailysales", "customerstats", "customerspendday"):
+                await conn.execute_query(f"DELETE FROM {table};")
+            await rebuild_daily_sales()
+            await rebuild_customer_spend()
+
+
+# Writes which can't update rollups incrementally (deletes which cascade to orders, raw sql) schedule a rebuild,
+# which runs in background. Rebuilds scheduled while one is running are merged into one more rebuild.
+class RollupRebuilder:
+    task: Optional[asyncio.Task] = None
+    pending = False
+
+    @classmethod
+    def schedule(cls) -> None:
+        if cls.task is not None and not cls.task.done():
+            cls.pending = True
+            return
+        cls.task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            cls.pending = False
+            try:
+                await rebuild_rollups()
+            except Exception:
+                logger.exception("Failed to rebuild sales rollups")
+            if not cls.pending:
+                return
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls.task is not None:
+            cls.task.cancel()
+            await asyncio.gather(cls.task, return_exceptions=True)
+            cls.task = None
@@ -1,32 +1,39 @@
 from fastapi import APIRouter, HTTPException
 from tortoise.expressions import Q
 
+from app.cache import invalidate, bump_versions, version_key
+from app.exports import export_search
 from app.models.category import Category
 from app.models.product import Product
-from app.schemas import SearchData
+from app.schemas import SearchData, ExportFormat
 from app.schemas.categories import CategoryCreateModel, CategoryUpdateModel, CategoriesBatchLoadModel
-from app.utils import Permissions, AuthManagerDep, search
+from app.utils import Permissions, AuthManagerDep, search, paginate, PaginationDep
 
 router = APIRouter(prefix="/api/v0/categories")
 
 
 @router.get("/")
-async def get_categories(page: int=0, limit: int = 50):
-    if limit == 0:
-        limit = await Category.all().count()
-    return {"results": await Category.all().limit(limit).offset(page * limit), "count": await Category.all().count()}
+async def get_categories(pagination: PaginationDep):
+    if pagination.pageSize == 0:
+        pagination.pageSize = await Category.all().count()
+    return await paginate(Category.all(), pagination)
 
 
 @router.get("/search")
-async def search_categories(page: int=0, name: str="", description: str=""):
+async def search_categories(pagination: PaginationDep, name: str="", description: str=""):
     q = Category.all().filter(Q(name__istartswith=name) | Q(description__istartswith=description))
-    return {"results": await q.limit(50).offset(page * 50), "count": await q.count()}
+    return await paginate(q, pagination)
 
 
 @router.post("/search")
 async def search_categories(data: SearchData):
-    query, countQuery = search(Category, data)
-    return {"results": await query, "count": await countQuery.count()}
+    query, orderings = search(Category, data)
+    return await paginate(query, data.pagination, orderings)
+
+
+@router.post("/search/export")
+async def export_categories(data: SearchData, manager: AuthManagerDep, fmt: ExportFormat = "csv"):
+    return await export_search(Category, data, fmt)
 
 
 @router.get("/{category_id}")
@@ -49,7 +56,9 @@ async def create_category(data: CategoryCreateModel, manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.MANAGE_CATEGORIES):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    return await Category.create(name=data.name, description=data.description)
+    category = await Category.create(name=data.name, description=data.description)
+    invalidate(Category)
+    return category
 
 
 @router.patch("/{category_id}")
@@ -59,6 +68,8 @@ async def update_category(category_id: int, data: CategoryUpdateModel, manager:
 
     cat = await Category.get_or_none(id=category_id)
     await cat.update(**data.model_dump(exclude_defaults=True))
+    await bump_versions(version_key(Category), version_key(Category, cat.id))
+    invalidate(Category)
     return cat
 
 
@@ -68,3 +79,5 @@ async def delete_category(category_id: int, manager: AuthManagerDep):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
     await Category.filter(id=category_id).delete()
+    await bump_versions(version_key(Category), version_key(Category, category_id))
+    invalidate(Category, Product)
@@ -1,23 +1,29 @@
 from fastapi import APIRouter, HTTPException
 
-from app.models import Characteristic
-from app.schemas import SearchData
+from app.cache import invalidate
+from app.exports import export_search
+from app.models import Characteristic, ProductCharacteristic
+from app.schemas import SearchData, ExportFormat
 from app.schemas.characteristics import CharCreateModel, CharUpdateModel
-from app.utils import AuthManagerDep, Permissions, search
+from app.utils import AuthManagerDep, Permissions, search, paginate, PaginationDep
 
 router = APIRouter(prefix="/api/v0/characteristics")
 
 
 @router.get("/")
-async def get_characteristics(page: int=0, limit: int = 50):
-    return {"results": await Characteristic.all().limit(limit).offset(page * limit),
-            "count": await Characteristic.all().count()}
+async def get_characteristics(pagination: PaginationDep):
+    return await paginate(Characteristic.all(), pagination)
 
 
 @router.post("/search")
 async def search_characteristics_post(data: SearchData):
-    query, countQuery = search(Characteristic, data)
-    return {"results": await query, "count": await countQuery.count()}
+    query, orderings = search(Characteristic, data)
+    return await paginate(query, data.pagination, orderings)
+
+
+@router.post("/search/export")
+async def export_characteristics(data: SearchData, manager: AuthManagerDep, fmt: ExportFormat = "csv"):
+    return await export_search(Characteristic, data, fmt)
 
 
 @router.get("/{char_id}")
@@ -30,7 +36,9 @@ async def create_characteristic(data: CharCreateModel, manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.MANAGE_PRODUCTS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    return await Characteristic.create(**data.model_dump())
+    char = await Characteristic.create(**data.model_dump())
+    invalidate(Characteristic)
+    return char
 
 
 @router.patch("/{char_id}")
@@ -42,6 +50,7 @@ async def update_characteristic(char_id: int, data: CharUpdateModel, manager: Au
         raise HTTPException(status_code=404, detail="Unknown characteristic!")
 
     await char.update(**data.model_dump(exclude_defaults=True))
+    invalidate(Characteristic)
     return char
 
 
@@ -51,3 +60,4 @@ async def delete_characteristic(char_id: int, manager: AuthManagerDep):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
     await Characteristic.filter(id=char_id).delete()
+    invalidate(Characteristic, ProductCharacteristic)
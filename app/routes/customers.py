@@ -1,30 +1,39 @@
 from fastapi import APIRouter, HTTPException
 from tortoise.expressions import Q
 
+from app.cache import invalidate, bump_versions, ALL_DATA, version_key
+from app.exports import export_search
+from app.fulltext import fulltext_search
 from app.models.customer import Customer
-from app.schemas import SearchData
+from app.rollups import RollupRebuilder
+from app.schemas import SearchData, ExportFormat
 from app.schemas.customers import CustomerModel
-from app.utils import AuthManagerDep, Permissions, search
+from app.utils import AuthManagerDep, Permissions, search, paginate, PaginationDep
 
 router = APIRouter(prefix="/api/v0/customers")
 
 
 @router.get("/")
-async def get_customers(manager: AuthManagerDep, page: int = 0, limit: int = 50):
-    return {"results": await Customer.all().limit(limit).offset(page * limit), "count": await Customer.all().count()}
+async def get_customers(manager: AuthManagerDep, pagination: PaginationDep):
+    return await paginate(Customer.all(), pagination)
 
 
 @router.post("/search")
 async def search_customer_post(data: SearchData):
-    query, countQuery = search(Customer, data)
-    return {"results": await query, "count": await countQuery.count()}
+    query, orderings = search(Customer, data)
+    return await paginate(query, data.pagination, orderings)
+
+
+@router.post("/search/export")
+async def export_customers(data: SearchData, manager: AuthManagerDep, fmt: ExportFormat = "csv"):
+    return await export_search(Customer, data, fmt)
 
 
 @router.get("/search")
-async def search_customers(page: int=0, anything: str=""):
-    q = Customer.all().filter(Q(first_name__icontains=anything) | Q(last_name__icontains=anything) |
-                              Q(email__istartswith=anything))
-    return {"results": await q.limit(50).offset(page * 50), "count": await q.count()}
+async def search_customers(pagination: PaginationDep, anything: str=""):
+    query, orderings = fulltext_search(Customer, anything, lambda text: Q(first_name__icontains=text) |
+                                       Q(last_name__icontains=text) | Q(email__istartswith=text))
+    return await paginate(query, pagination, orderings)
 
 
 @router.get("/{category_id}")
@@ -39,7 +48,10 @@ async def create_customer(data: CustomerModel, manager: AuthManagerDep):
 
     if (customer := await Customer.get_or_none(**data.model_dump())) is not None:
         return customer
-    return await Customer.create(**data.model_dump())
+
+    customer = await Customer.create(**data.model_dump())
+    invalidate(Customer)
+    return customer
 
 
 @router.patch("/{customer_id}")
@@ -49,6 +61,8 @@ async def update_customer(customer_id: int, data: CustomerModel, manager: AuthMa
 
     customer = await Customer.get_or_none(id=customer_id)
     await customer.update(**data.model_dump())
+    await bump_versions(version_key(Customer, customer.id))
+    invalidate(Customer)
     return customer
 
 
@@ -58,3 +72,6 @@ async def delete_category(customer_id: int, manager: AuthManagerDep):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
     await Customer.filter(id=customer_id).delete()
+    await bump_versions(ALL_DATA)
+    RollupRebuilder.schedule()
+    invalidate()
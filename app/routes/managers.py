@@ -1,7 +1,8 @@
-from bcrypt import hashpw, gensalt
 from fastapi import APIRouter, HTTPException
 
+from app.cache import invalidate
 from app.models.manager import ManagerPd, Manager
+from app.passwords import hash_password
 from app.schemas.managers import ManagerCreateModel
 from app.utils import AuthManagerDep, Permissions
 
@@ -13,5 +14,7 @@ async def create_manager(data: ManagerCreateModel, manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.ADMIN):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    data.password = hashpw(data.password.encode().replace(b"\x00", b""), gensalt()).decode()
-    return await ManagerPd.from_tortoise_orm(await Manager.create(**data.model_dump()))
+    data.password = await hash_password(data.password)
+    new_manager = await Manager.create(**data.model_dump())
+    invalidate(Manager)
+    return await ManagerPd.from_tortoise_orm(new_manager)
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.jobs import ReportJobs
+from app.metrics import render_metrics
+from app.passwords import PasswordHasher
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    jobs = list(ReportJobs.jobs.values())
+    gauges = {
+        "password_hash_waiting": ("Password hashing calls waiting for a worker.", PasswordHasher.waiting),
+        "password_hash_running": ("Password hashing calls being executed.", PasswordHasher.running),
+        "report_jobs_queued": ("Report jobs waiting in the queue.",
+                               ReportJobs.queue.qsize() if ReportJobs.queue is not None else 0),
+        "report_jobs_running": ("Report jobs being generated.", sum(job.status == "running" for job in jobs)),
+    }
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
@@ -1,67 +1,160 @@
 from fastapi import APIRouter, HTTPException
-from tortoise.functions import Count
-
-from app.models import Customer, Manager, Product
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise import connections
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+from app.cache import invalidate, bump_versions, version_key
+from app.exports import export_search
+from app.migrations import advisory_lock, column_exists
+from app.models import Customer, Manager, Product, Category, DailySales, CustomerStats, CustomerSpendDay
 from app.models.customer import CustomerPd
-from app.models.order import Order, OrderPd
+from app.models.order import Order, OrderPd, CLOSED_STATUSES, is_open
 from app.models.order_item import OrderItemPd, OrderItem
 from app.models.product import ProductPd
-from app.schemas import SearchData
+from app.rollups import record_order
+from app.schemas import SearchData, ExportFormat
 from app.schemas.orders import OrderCreateModel, OrderUpdateModel
-from app.utils import AuthManagerDep, Permissions, search
+from app.utils import AuthManagerDep, Permissions, search, paginate, PaginationDep
 
 router = APIRouter(prefix="/api/v0/orders")
 
 
 @router.get("/")
-async def get_orders(page: int=0, limit: int = 50):
-    orders = await Order.all().limit(limit).offset(page * limit).select_related("customer")
-    return {"results": [await order_to_resp(order) for order in orders], "count": await Order.all().count()}
+async def get_orders(pagination: PaginationDep):
+    resp = await paginate(Order.all().select_related("customer"), pagination)
+    resp["results"] = await orders_to_resp(resp["results"])
+    return resp
 
 
 @router.post("/search")
 async def search_order_post(data: SearchData):
-    query, countQuery = search(Order, data)
-    query = query.select_related("customer")
-    return {"results": [await order_to_resp(order) for order in await query], "count": await countQuery.count()}
+    query, orderings = search(Order, data)
+    resp = await paginate(query.select_related("customer"), data.pagination, orderings)
+    resp["results"] = await orders_to_resp(resp["results"])
+    return resp
+
+
+@router.post("/search/export")
+async def export_orders(data: SearchData, manager: AuthManagerDep, fmt: ExportFormat = "csv"):
+    return await export_search(Order, data, fmt)
+
+
+async def decrement_stock(conn: BaseDBAsyncClient, quantities: dict[int, int]) -> bool:
+    cases = " ".join(["WHEN %s THEN %s"] * len(quantities))
+    case_values = [value for item in quantities.items() for value in item]
+    query = (
+        f"UPDATE product SET quantity = quantity - CASE id {cases} END "
+        f"WHERE id IN ({', '.join(['%s'] * len(quantities))}) AND quantity >= CASE id {cases} END;"
+    )
+    updated, _ = await conn.execute_query(query, case_values + list(quantities) + case_values)
+    return updated == len(quantities)
 
 
 @router.post("/")
 async def create_order(data: OrderCreateModel):
     inf = data.customer_info
-    customer = await Customer.get_or_none(**inf.model_dump()) or await Customer.create(**inf.model_dump())
-    manager = await Manager.annotate(c=Count("orders")).order_by("c").limit(1)
-    if not manager:
-        raise HTTPException(status_code=400, detail="No managers found to process this order!")
-    else:
-        manager = manager[0]
-
-    order = await Order.create(status="processing", address=data.address, type=data.type, customer=customer,
-                               manager=manager)
-
     q = {prod.id: prod.quantity for prod in data.products}
-    for prod in await Product.filter(id__in=[prod.id for prod in data.products]).all():
-        lim = prod.per_order_limit if prod.per_order_limit != 0 else prod.quantity
-        lim = min(lim, prod.quantity)
-        if q[prod.id] > lim:
-            q[prod.id] = lim
-        if lim == 0:
-            continue
-        await OrderItem.create(order=order, product=prod, quantity=q[prod.id], price=prod.price)
-        await prod.update(quantity=prod.quantity-q[prod.id])
 
+    async with in_transaction() as conn:
+        customer = await Customer.get_or_none(**inf.model_dump()).using_db(conn) \
+                   or await Customer.create(**inf.model_dump(), using_db=conn)
+        manager = await Manager.all().order_by("open_orders", "id").limit(1).using_db(conn)
+        if not manager:
+            raise HTTPException(status_code=400, detail="No managers found to process this order!")
+        else:
+            manager = manager[0]
+
+        order = await Order.create(status="processing", address=data.address, type=data.type, customer=customer,
+                                   manager=manager, using_db=conn)
+
+        # Products aren't locked while limits are computed, stock is checked again by the conditional decrement,
+        # which fails (and rolls back the whole order) if other orders took the stock in the meantime.
+        items = []
+        for prod in await Product.filter(id__in=list(q)).using_db(conn):
+            lim = prod.per_order_limit if prod.per_order_limit != 0 else prod.quantity
+            lim = min(lim, prod.quantity)
+            if q[prod.id] > lim:
+                q[prod.id] = lim
+            if lim == 0:
+                continue
+            items.append(OrderItem(order=order, product=prod, quantity=q[prod.id], price=prod.price))
+
+        if items:
+            await OrderItem.bulk_create(items, using_db=conn)
+        await record_order(conn, order, items)
+        await bump_versions(version_key(Customer, customer.id),
+                            *(version_key(Product, item.product_id) for item in items),
+                            *(version_key(Category, item.product.category_id) for item in items
+                              if item.product.category_id is not None), using_db=conn)
+        # Product and manager rows are locked until commit, so they are updated last to keep concurrent orders
+        # (which usually buy the same products and pick the same manager) from waiting for the whole transaction.
+        if items and not await decrement_stock(conn, {item.product_id: item.quantity for item in items}):
+            raise HTTPException(status_code=409, detail="Products stock has changed, try again!")
+        await Manager.filter(id=manager.id).using_db(conn).update(open_orders=F("open_orders") + 1)
+
+    invalidate(Customer, Manager, Order, OrderItem, Product, DailySales,
+               CustomerStats, CustomerSpendDay)
     return await get_order(order.id)
 
 
-async def order_to_resp(order: Order) -> list[dict]:
-    resp = (await OrderPd.from_tortoise_orm(order)).model_dump()
-    resp["customer"] = (await CustomerPd.from_tortoise_orm(order.customer)).model_dump()
-    resp["items"] = []
-    for prod in await order.items.all().select_related("orderitems"):
-        resp["items"].append((await ProductPd.from_tortoise_orm(prod)).model_dump() |
-                             (await OrderItemPd.from_tortoise_orm(prod.orderitems)).model_dump(exclude={"id"}))
+# generate_schemas doesn't change existing tables, so open_orders column is added on startup if missing.
+# Counters are filled from order history only when the column is added, after that they are maintained by
+# order writes (and running workers may be changing them at the same time).
+async def sync_open_orders() -> None:
+    conn = connections.get("default")
+    async with advisory_lock("cw_open_orders"):
+        if await column_exists(Manager, "open_orders"):
+            return
+        await conn.execute_query("ALTER TABLE manager ADD COLUMN open_orders INT NOT NULL DEFAULT 0, "
+                                 "ADD INDEX idx_manager_open_orders (open_orders);")
+
+        statuses = ", ".join(["%s"] * len(CLOSED_STATUSES))
+        query = (
+            "UPDATE manager SET open_orders = ("
+            "    SELECT COUNT(*) FROM `order` "
+            f"    WHERE `order`.manager_id = manager.id AND LOWER(`order`.status) NOT IN ({statuses})"
+            ");"
+        )
+        await conn.execute_query(query, list(CLOSED_STATUSES))
+
+
+async def fetch_order_items(order_ids: list[int]) -> list[OrderItem]:
+    if not order_ids:
+        return []
+    return await OrderItem.filter(order_id__in=order_ids).select_related("product").order_by("id")
 
-    return resp
+
+# ProductPd/OrderItemPd have no relations, so sync model_validate doesn't need to fetch anything
+# (and can be called from a thread, see reports).
+def group_order_items(order_ids: list[int], order_items: list[OrderItem]) -> dict[int, list[dict]]:
+    items = {order_id: [] for order_id in order_ids}
+    for item in order_items:
+        items[item.order_id].append(ProductPd.model_validate(item.product).model_dump() |
+                                    OrderItemPd.model_validate(item).model_dump(exclude={"id"}))
+
+    return items
+
+
+async def load_order_items(order_ids: list[int]) -> dict[int, list[dict]]:
+    return group_order_items(order_ids, await fetch_order_items(order_ids))
+
+
+async def orders_to_resp(orders: list[Order]) -> list[dict]:
+    items = await load_order_items([order.id for order in orders])
+
+    result = []
+    for order in orders:
+        resp = OrderPd.model_validate(order).model_dump()
+        resp["customer"] = CustomerPd.model_validate(order.customer).model_dump()
+        resp["items"] = items[order.id]
+        result.append(resp)
+
+    return result
+
+
+async def order_to_resp(order: Order) -> dict:
+    return (await orders_to_resp([order]))[0]
 
 
 @router.get("/{order_id}")
@@ -78,10 +171,18 @@ async def get_order(order_id: int):
 async def update_order(order_id: int, data: OrderUpdateModel, manager: AuthManagerDep):
     q = {"id": order_id}
     if not Permissions.check(manager, Permissions.MANAGE_ORDERS):
-        q["manager"] = manager
+        q["manager_id"] = manager.id
 
-    if (order := await Order.get_or_none(**q)) is None:
-        raise HTTPException(status_code=404, detail="Unknown order!")
+    async with in_transaction() as conn:
+        if (order := await Order.filter(**q).select_for_update().using_db(conn).get_or_none()) is None:
+            raise HTTPException(status_code=404, detail="Unknown order!")
+
+        was_open = is_open(order.status)
+        await order.update(using_db=conn, **data.model_dump(exclude_defaults=True))
+        if was_open != is_open(order.status):
+            diff = -1 if was_open else 1
+            await Manager.filter(id=order.manager_id).using_db(conn).update(open_orders=F("open_orders") + diff)
+        await bump_versions(version_key(Customer, order.customer_id), using_db=conn)
 
-    await order.update(**data.model_dump(exclude_defaults=True))
+    invalidate(Manager, Order)
     return await get_order(order_id)
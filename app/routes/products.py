@@ -1,131 +1,75 @@
-from fastapi import APIRouter, HTTPException
-from tortoise import connections
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from tortoise.expressions import Q
 
-from app.models import Characteristic, ProductCharacteristic
+from app.cache import invalidate, bump_versions, version_key
+from app.exports import export_search
+from app.models import Category, Characteristic, ProductCharacteristic, PriceRecommendation
+from app.facets import typed_value, filter_products, product_facets
+from app.fulltext import fulltext_search
+from app.imports import ProductImport, spool_body
 from app.models.product import Product
-from app.schemas import SearchData
-from app.schemas.products import ProductCreateModel, ProductUpdateModel, PutCharacteristic
-from app.utils import AuthManagerDep, Permissions, search
+from app.recommendations import DEFAULT_INTERVAL, calculate_recommendations
+from app.rollups import RollupRebuilder
+from app.schemas import SearchData, ExportFormat
+from app.schemas.products import ProductCreateModel, ProductUpdateModel, PutCharacteristic, FacetSearchModel, \
+    ProductIdsModel, ImportFormat
+from app.utils import AuthManagerDep, Permissions, search, paginate, PaginationDep
 
 router = APIRouter(prefix="/api/v0/products")
 
 
 @router.get("/")
-async def get_products(page: int=0, limit: int = 50):
-    return {"results": await Product.all().limit(limit).offset(page * limit), "count": await Product.all().count()}
+async def get_products(pagination: PaginationDep):
+    return await paginate(Product.all(), pagination)
 
 
 @router.post("/search")
 async def search_products_post(data: SearchData):
-    query, countQuery = search(Product, data)
-    return {"results": await query, "count": await countQuery.count()}
+    query, orderings = search(Product, data)
+    return await paginate(query, data.pagination, orderings)
+
+
+@router.post("/search/export")
+async def export_products(data: SearchData, manager: AuthManagerDep, fmt: ExportFormat = "csv"):
+    return await export_search(Product, data, fmt)
 
 
 @router.get("/search")
-async def search_products(page: int=0, anything: str=""):
-    q = Product.all().filter(Q(model__contains=anything) | Q(manufacturer__istartswith=anything))
-    return {"results": await q.limit(50).offset(page * 50), "count": await q.count()}
+async def search_products(pagination: PaginationDep, anything: str=""):
+    query, orderings = fulltext_search(Product, anything,
+                                       lambda text: Q(model__contains=text) | Q(manufacturer__istartswith=text))
+    return await paginate(query, pagination, orderings)
 
 
-def avg(values: list):
-    if not values:
-        return 0
-    return sum(values) / len(values)
+@router.post("/facets")
+async def facet_search_products(data: FacetSearchModel):
+    base = Product.all() if data.category_id is None else Product.filter(category_id=data.category_id)
+    resp = await paginate(filter_products(base, data.filters), data.pagination)
+    resp["facets"] = await product_facets(base, data.filters, data.facets)
+    return resp
 
 
 @router.get("/price-recommendations")
-async def price_recommendations(manager: AuthManagerDep, interval: int = 2):
+async def price_recommendations(manager: AuthManagerDep, interval: int = DEFAULT_INTERVAL):
     if not Permissions.check(manager, Permissions.MANAGE_PRODUCTS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
-
-    conn = connections.get("default")
-    query = (
-        "SELECT product.id, product.price, DAYOFYEAR(`order`.creation_time) AS day, COUNT(orderitem.id) AS items,"
-        "SUM(COALESCE(`return`.quantity, 0)) AS returns "
-        "FROM product "
-        "INNER JOIN orderitem ON product.id = orderitem.product_id "
-        "INNER JOIN `order` ON orderitem.order_id = `order`.id "
-        "LEFT JOIN `return` ON orderitem.id = `return`.id "
-        "WHERE `order`.creation_time > `order`.creation_time - INTERVAL %s WEEK "
-        "GROUP BY product.id, product.price, day;"
-    )
-
-    products = {}
-    for res in await conn.execute_query_dict(query, [interval]):
-        if res["id"] not in products:
-            products[res["id"]] = []
-        products[res["id"]].append({
-            "price": res["price"],
-            "day": res["day"],
-            "count": res["items"],
-            "returns": res["returns"]
-        })
-
-    total_analyzed = len(products)
-
-    ignored = []
-    for product_id in products:
-        if len(products[product_id]) < 3:
-            ignored.append(product_id)
-            continue
-
-        products[product_id].sort(key=lambda prod: prod["day"])
-
-    ignored_count = len(ignored)
-    for ig in ignored:
-        del products[ig]
-
-    ignored = []
-    for product_id in products:
-        count = products[product_id][0]["count"]
-        ret = products[product_id][0]["returns"]
-        changed = False
-        for day in products[product_id][1:]:
-            if day["count"] != count or day["returns"] != ret:
-                changed = True
-                break
-        if not changed:
-            ignored.append(product_id)
-
-    ignored_count += len(ignored)
-    for ig in ignored:
-        del products[ig]
-
-    percentages = {}
-    ignored = []
-    for product_id, days in products.items():
-        counts = [int(day["count"]) for day in days if int(day["count"]) > 0]
-        percentage_changes = [(counts[i] - counts[i - 1]) / counts[i - 1] for i in range(1, len(counts))]
-        buy = avg(percentage_changes)
-
-        counts = [int(day["returns"]) for day in days if int(day["returns"]) > 0]
-        percentage_changes = [(counts[i] - counts[i - 1]) / counts[i - 1] for i in range(1, len(counts))]
-        ret = -avg(percentage_changes)
-
-        coef = buy * 1.2 + ret * 0.7
-        if -0.25 < coef < 0.25:
-            ignored.append(product_id)
-            continue
-        percentages[product_id] = {"buy": buy, "return": ret, "coef": coef}
-
-    ignored_count += len(ignored)
-    for ig in ignored:
-        del products[ig]
-
-    raw_result = {}
-    for product_id in products:
-        coef = percentages[product_id]["coef"]
-        price = products[product_id][0]["price"]
-        res = {"price": price}
-        new_price_coef = abs(min(coef - 0.25, 0.5) / 10)
-        if coef < 0:
-            raw_result[product_id] = res | {"action": "down", "recommended_price": round(price * (1 - new_price_coef), 2)}
-        else:
-            raw_result[product_id] = res | {"action": "up", "recommended_price": round(price * (1 + new_price_coef), 2)}
-
+    if interval < 1:
+        raise HTTPException(status_code=400, detail="Invalid interval!")
+
+    stored = PriceRecommendation.filter(interval=interval)
+    if interval == DEFAULT_INTERVAL and (total_analyzed := await stored.count()):
+        recommended = await stored.filter(action__not_isnull=True) \
+            .values("product_id", "price", "action", "recommended_price")
+    else:
+        recommendations = await calculate_recommendations(interval)
+        total_analyzed = len(recommendations)
+        recommended = [rec for rec in recommendations if rec["action"] is not None]
+
+    raw_result = {rec["product_id"]: {"price": rec["price"], "action": rec["action"],
+                                      "recommended_price": rec["recommended_price"]} for rec in recommended}
     result = []
-    for prod in await Product.filter(id__in=list(raw_result.keys())).all():
+    for prod in await Product.filter(id__in=list(raw_result.keys())):
         result.append({
             "id": prod.id,
             "model": prod.model,
@@ -133,7 +77,8 @@ async def price_recommendations(manager: AuthManagerDep, interval: int = 2):
             **raw_result[prod.id],
         })
 
-    return {"total_analyzed": total_analyzed, "ignored": ignored_count, "raw_result": raw_result, "result": result}
+    return {"total_analyzed": total_analyzed, "ignored": total_analyzed - len(recommended), "raw_result": raw_result,
+            "result": result}
 
 
 @router.get("/{product_id}")
@@ -141,6 +86,19 @@ async def get_product(product_id: int):
     return await Product.get_or_none(id=product_id)
 
 
+# Characteristic names and units are returned once in "characteristics", products only map characteristic ids to values.
+@router.post("/chars/batch")
+async def get_products_characteristics(data: ProductIdsModel):
+    characteristics = {}
+    products = {product_id: {} for product_id in data.ids}
+    for value in await ProductCharacteristic.filter(product_id__in=data.ids).select_related("characteristic"):
+        char = value.characteristic
+        characteristics[char.id] = {"name": char.name, "unit": char.measurement_unit}
+        products[value.product_id][char.id] = value.value
+
+    return {"characteristics": characteristics, "products": products}
+
+
 @router.get("/{product_id}/chars")
 async def get_product_characteristics(product_id: int):
     if (product := await Product.get_or_none(id=product_id)) is None:
@@ -168,7 +126,8 @@ async def set_product_characteristic(product_id: int, char_id: int, data: PutCha
     if (char := await Characteristic.get_or_none(id=char_id)) is None:
         raise HTTPException(status_code=404, detail="Unknown characteristic!")
 
-    await ProductCharacteristic.update_or_create({"value": data.value}, product=product, characteristic=char)
+    await ProductCharacteristic.update_or_create(typed_value(data.value), product=product, characteristic=char)
+    invalidate(ProductCharacteristic)
     return {"id": char.id, "name": char.name, "value": data.value, "unit": char.measurement_unit}
 
 
@@ -183,6 +142,7 @@ async def delete_product_characteristic(product_id: int, char_id: int, manager:
         raise HTTPException(status_code=404, detail="Unknown characteristic!")
 
     await ProductCharacteristic.filter(product=product, characteristic=char).delete()
+    invalidate(ProductCharacteristic)
 
 
 @router.post("/")
@@ -190,7 +150,22 @@ async def create_product(data: ProductCreateModel, manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.MANAGE_PRODUCTS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    return await Product.create(**data.model_dump())
+    product = await Product.create(**data.model_dump())
+    if product.category_id is not None:
+        await bump_versions(version_key(Category, product.category_id))
+    invalidate(Product)
+    return product
+
+
+# File is sent as the request body, progress of the import is streamed as ndjson (one line per chunk of rows).
+@router.post("/import")
+async def import_products(request: Request, manager: AuthManagerDep, fmt: ImportFormat = "csv"):
+    if not Permissions.check(manager, Permissions.MANAGE_PRODUCTS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    product_import = ProductImport(await spool_body(request), fmt)
+    await product_import.open()
+    return StreamingResponse(product_import.progress(), media_type="application/x-ndjson")
 
 
 @router.patch("/{product_id}")
@@ -201,7 +176,12 @@ async def update_product(product_id: int, data: ProductUpdateModel, manager: Aut
     if (product := await Product.get_or_none(id=product_id)) is None:
         raise HTTPException(status_code=404, detail="Unknown product!")
 
+    old_category_id = product.category_id
     await product.update(**data.model_dump(exclude_defaults=True))
+    await bump_versions(version_key(Product), version_key(Product, product.id),
+                        *(version_key(Category, category_id) for category_id in {old_category_id, product.category_id}
+                          if category_id is not None))
+    invalidate(Product)
     return product
 
 
@@ -210,4 +190,10 @@ async def delete_product(product_id: int, manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.MANAGE_PRODUCTS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    await Product.filter(id=product_id).delete()
+    if (product := await Product.get_or_none(id=product_id)) is None:
+        return
+    await product.delete()
+    await bump_versions(version_key(Product), version_key(Product, product.id),
+                        *((version_key(Category, product.category_id),) if product.category_id is not None else ()))
+    RollupRebuilder.schedule()
+    invalidate()
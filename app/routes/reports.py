@@ -1,99 +1,48 @@
-from datetime import timedelta, datetime
-from io import BytesIO
-from typing import Literal
-
-from fastapi import APIRouter, HTTPException, Response
-from openpyxl.cell import Cell
-from openpyxl.styles import Alignment, Font, Fill, PatternFill, Color
-from openpyxl.utils import column_index_from_string
-from openpyxl.workbook import Workbook
-from openpyxl.worksheet.worksheet import Worksheet
-from pytz import UTC
+from datetime import timedelta, datetime, date
+from hashlib import sha256
+from typing import Any, Callable, Awaitable
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from tortoise import connections
 from tortoise.functions import Count, Sum
 
-from app.models import Product, Customer, Order, Category, Return
+from app.cache import ReportCache, data_version, version_key
+from app.jobs import ReportJobs, ReportJob
+from app.models import Product, Customer, Order, Category, Return, Manager, OrderItem
 from app.models.order import OrderPd
-from app.models.order_item import OrderItemPd
 from app.models.product import ProductPd
-from app.utils import AuthManagerDep, Permissions
+from app.routes.orders import fetch_order_items, group_order_items
+from app.schemas.reports import ReportJobCreateModel, ReportType, ReportFormat
+from app.utils import AuthManagerDep, Permissions, iter_chunks
+from app.xlsx import XlsxWriter, StyledValue
 
 router = APIRouter(prefix="/api/v0/reports")
 
 
-class CustomWorksheet:
-    def __init__(self, ws: Worksheet):
-        self.ws = ws
+GREEN = "89EB34"
 
-    def fix_formatting(self) -> Worksheet:
-        for col in self.ws.columns:
-            max_len = 0
-            let = col[0].column_letter
-            for cell in col:
-                cell.alignment = Alignment(horizontal='left', vertical='center')
-                try:
-                    max_len = max(max_len, len(str(cell.value)))
-                except:
-                    pass
 
-            self.ws.column_dimensions[let].width = (max_len+2)
+def title(value: Any) -> StyledValue:
+    return StyledValue(value, fill=(GREEN, .15), bold=True)
 
-        return self.ws
 
-    def append(self, iterable: list | tuple | range | dict, **cell_kwargs):
-        def update_or_create_cell(content_: Cell | str | float | datetime | int, col_idx_, row_idx_):
-            if not isinstance(content_, Cell):
-                return Cell(self.ws, row=row_idx, column=col_idx, value=content_, **cell_kwargs)
+def f65(value: Any) -> StyledValue:
+    return StyledValue(value, fill=(GREEN, .65))
 
-            cell_ = content_
-            cell_.parent = self.ws
-            cell_.column = col_idx_
-            cell_.row = row_idx_
 
-            return cell_
+def f85(value: Any) -> StyledValue:
+    return StyledValue(value, fill=(GREEN, .85))
 
-        row_idx = self.ws._current_row + 1
-
-        if isinstance(iterable, (list, tuple, range)):
-            for col_idx, content in enumerate(iterable, 1):
-                self.ws._cells[(row_idx, col_idx)] = update_or_create_cell(content, col_idx, row_idx)
-
-        elif isinstance(iterable, dict):
-            for col_idx, content in iterable.items():
-                if isinstance(col_idx, str):
-                    col_idx = column_index_from_string(col_idx)
-                self.ws._cells[(row_idx, col_idx)] = update_or_create_cell(content, col_idx, row_idx)
-
-        else:
-            self.ws._invalid_row(iterable)
-
-        self.ws._current_row = row_idx
-
-    def __call__(self, value: str | float | int | datetime) -> Cell:
-        return Cell(self.ws, value=value)
-
-
-def upd_cell(cell: Cell | str | float | int | datetime, **cell_attributes) -> Cell:
-    if not isinstance(cell, Cell):
-        cell = Cell(None, value=cell)
-
-    for attr in cell_attributes:
-        setattr(cell, attr, cell_attributes[attr])
-    return cell
-
-
-def mkfill(rgb: str, tint: float) -> Fill:
-    return PatternFill(start_color=Color(rgb, tint=tint), fill_type="solid")
-
-
-@router.get("/products/{product_id}")
-async def product_report(manager: AuthManagerDep, product_id: int, fmt: Literal["json", "excel"]="json"):
-    if not Permissions.check(manager, Permissions.READ_REPORTS):
-        raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
+async def product_report_data(product_id: int) -> dict:
     product = await Product.get_or_none(id=product_id).select_related("category") \
         .annotate(order_count=Count("orderitems"), orderitem_count=Sum("orderitems__quantity"))
+    if product is None:
+        raise HTTPException(status_code=404, detail="Unknown product!")
 
-    result = {
+    return {
         "id": product.id,
         "model": product.model,
         "manufacturer": product.manufacturer,
@@ -102,197 +51,312 @@ async def product_report(manager: AuthManagerDep, product_id: int, fmt: Literal[
         "per_order_limit": product.per_order_limit,
         "image_url": product.image_url,
         "warranty_days": product.warranty_days,
-        "category_name": product.category.name,
+        "category_name": product.category.name if product.category is not None else None,
         "order_count": product.order_count,
         "order_item_count": product.orderitem_count,
     }
 
-    if fmt == "excel":
-        wb = Workbook()
-        ws = wb.active
-        ws.append({"A": "Product Id:", "B": product.id})
-        ws.append({"A": "Product Manufacturer:", "B": product.manufacturer})
-        ws.append({"A": "Product Model:", "B": product.model})
-        ws.append({"A": "Product Price:", "B": product.price})
-        ws.append({"A": "Product Quantity:", "B": product.quantity})
-        ws.append({"A": "Limit per order:", "B": product.per_order_limit})
-        ws.append({"A": "Warranty days:", "B": product.warranty_days})
-        ws.append({"A": "Category:", "B": product.category.name})
-        if product.image_url:
-            ws.append({"A": "Image url:", "B": product.image_url})
-        ws.append({"A": "Order count:", "B": product.order_count})
-        ws.append({"A": "Order item count:", "B": product.orderitem_count})
-        fp = BytesIO()
-        setattr(fp, "name", f"product-{product.id}-report.xlsx")
-        wb.save(fp)
-        return Response(content=fp.getvalue(), media_type="application/vnd.ms-excel")
+
+async def product_report_xlsx(result: dict) -> XlsxWriter:
+    ws = XlsxWriter(f"product-{result['id']}-report.xlsx")
+    ws.append({"A": "Product Id:", "B": result["id"]})
+    ws.append({"A": "Product Manufacturer:", "B": result["manufacturer"]})
+    ws.append({"A": "Product Model:", "B": result["model"]})
+    ws.append({"A": "Product Price:", "B": result["price"]})
+    ws.append({"A": "Product Quantity:", "B": result["quantity"]})
+    ws.append({"A": "Limit per order:", "B": result["per_order_limit"]})
+    ws.append({"A": "Warranty days:", "B": result["warranty_days"]})
+    ws.append({"A": "Category:", "B": result["category_name"]})
+    if result["image_url"]:
+        ws.append({"A": "Image url:", "B": result["image_url"]})
+    ws.append({"A": "Order count:", "B": result["order_count"]})
+    ws.append({"A": "Order item count:", "B": result["order_item_count"]})
+    return ws
+
+
+# Validation and rendering of big reports (customers with many orders, categories with many products) is done in
+# threads, so building a report doesn't block other requests served by the event loop.
+def orders_report(orders: list[Order], order_items: list[OrderItem]) -> list[dict]:
+    items = group_order_items([order.id for order in orders], order_items)
+    result = []
+    for order in orders:
+        order_resp = OrderPd.model_validate(order).model_dump()
+        order_resp["items"] = items[order.id]
+        order_resp["total"] = sum(item["quantity"] * item["price"] for item in order_resp["items"])
+        result.append(order_resp)
 
     return result
 
 
-@router.get("/customers/{customer_id}")
-async def customer_report(manager: AuthManagerDep, customer_id: int, fmt: Literal["json", "excel"]="json"):
-    if not Permissions.check(manager, Permissions.READ_REPORTS):
-        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+def products_report(products: list[Product]) -> list[dict]:
+    return [ProductPd.model_validate(product).model_dump() for product in products]
+
 
-    customer = await Customer.get_or_none(id=customer_id).annotate(order_count=Count("orders"))
+async def customer_report_data(customer_id: int) -> dict:
+    if (customer := await Customer.get_or_none(id=customer_id)) is None:
+        raise HTTPException(status_code=404, detail="Unknown customer!")
 
+    orders = await Order.filter(customer=customer).order_by("id")
     result = {
         "id": customer.id,
         "first_name": customer.first_name,
         "last_name": customer.last_name,
         "email": customer.email,
         "phone_number": customer.phone_number,
-        "order_count": customer.order_count,
+        "order_count": len(orders),
         "orders": [],
         "returns": [],
         "total": 0,
         "averages": {}
     }
 
-    orders = await Order.filter(customer=customer).all()
-    for order in orders:
-        result["orders"].append((await OrderPd.from_tortoise_orm(order)).model_dump())
-        result["orders"][-1]["items"] = []
-
-        order_total = 0
-        orderitems = await order.items.all().select_related("orderitems")
-        for prod in orderitems:
-            result["orders"][-1]["items"].append(
-                (await ProductPd.from_tortoise_orm(prod)).model_dump() |
-                (await OrderItemPd.from_tortoise_orm(prod.orderitems)).model_dump(exclude={"id"})
-            )
-            order_total += prod.orderitems.quantity * prod.orderitems.price
-
-        result["orders"][-1]["total"] = order_total
-        result["total"] += order_total
-
-        if order.creation_time > (datetime.now() - timedelta(days=365)).replace(tzinfo=UTC):
-            date = f"{order.creation_time.month}.{order.creation_time.year}"
-            if date not in result["averages"]:
-                result["averages"][date] = 0
-
-            if orderitems:
-                result["averages"][date] += order_total / len(orderitems)
-
-        for ret in await Return.filter(order=order).select_related("order_item", "order_item__product").all():
-            result["returns"].append({
-                "item": {
-                    "model": ret.order_item.product.model,
-                    "manufacturer": ret.order_item.product.manufacturer,
-                    "price": ret.order_item.product.price,
-                },
-                "quantity": ret.quantity,
-                "time": ret.creation_time,
-            })
+    order_items = await fetch_order_items([order.id for order in orders])
+    result["orders"] = await run_in_threadpool(orders_report, orders, order_items)
+    result["total"] = sum(order["total"] for order in result["orders"])
+
+    conn = connections.get("default")
+    query = (
+        "SELECT YEAR(`order`.creation_time) AS year, MONTH(`order`.creation_time) AS month, "
+        "COALESCE(SUM(order_sums.total / order_sums.items), 0) AS average "
+        "FROM `order` "
+        "LEFT JOIN ("
+        "    SELECT orderitem.order_id, SUM(orderitem.price * orderitem.quantity) AS total, COUNT(*) AS items "
+        "    FROM orderitem INNER JOIN `order` ON `order`.id = orderitem.order_id "
+        "    WHERE `order`.customer_id = %s GROUP BY orderitem.order_id"
+        ") order_sums ON order_sums.order_id = `order`.id "
+        "WHERE `order`.customer_id = %s AND `order`.creation_time > %s "
+        "GROUP BY year, month ORDER BY year, month;"
+    )
+    year_ago = datetime.now() - timedelta(days=365)
+    for row in await conn.execute_query_dict(query, [customer.id, customer.id, year_ago]):
+        result["averages"][f"{row['month']}.{row['year']}"] = row["average"]
+
+    returns = await Return.filter(order__customer_id=customer.id).select_related("order_item__product").order_by("id")
+    for ret in returns:
+        result["returns"].append({
+            "item": {
+                "model": ret.order_item.product.model,
+                "manufacturer": ret.order_item.product.manufacturer,
+                "price": ret.order_item.product.price,
+            },
+            "quantity": ret.quantity,
+            "time": ret.creation_time,
+        })
 
-    if fmt == "excel":
-        wb = Workbook()
-        ws = CustomWorksheet(wb.active)
-        ws.append({"A": "REPORT GENERATED AT", "B": datetime.now()})
-        ws.append({})
-        ws.append({"A": "Customer First Name", "B": customer.first_name})
-        ws.append({"A": "Customer Last Name", "B": customer.last_name})
-        ws.append({"A": "Customer Email", "B": customer.email})
-        ws.append({"A": "Customer Phone Number", "B": str(customer.phone_number)})
-        ws.append({"A": "Order count", "B": customer.order_count})
-        ws.append({"A": "Total", "B": result["total"]})
-        ws.append({})
-        ws.append({"A": "Average per month:"})
-        for month, money in result["averages"].items():
-            ws.append({"A": datetime.strptime(month, "%m.%Y"), "B": money})
+    return result
+
+
+async def customer_report_xlsx(result: dict) -> XlsxWriter:
+    return await run_in_threadpool(write_customer_report, result)
+
+
+def write_customer_report(result: dict) -> XlsxWriter:
+    ws = XlsxWriter(f"customer-{result['id']}-report.xlsx")
+    ws.append({"A": "REPORT GENERATED AT", "B": datetime.now()})
+    ws.append({})
+    ws.append({"A": "Customer First Name", "B": result["first_name"]})
+    ws.append({"A": "Customer Last Name", "B": result["last_name"]})
+    ws.append({"A": "Customer Email", "B": result["email"]})
+    ws.append({"A": "Customer Phone Number", "B": str(result["phone_number"])})
+    ws.append({"A": "Order count", "B": result["order_count"]})
+    ws.append({"A": "Total", "B": result["total"]})
+    ws.append({})
+    ws.append({"A": "Average per month:"})
+    for month, money in result["averages"].items():
+        ws.append({"A": datetime.strptime(month, "%m.%Y"), "B": money})
+    ws.append({})
+    ws.append({"A": title("Orders:")})
+    for order in result["orders"]:
+        ws.append({"A": f65("Status"), "B": f65(order["status"])})
+        ws.append({"A": f65("Creation Time"), "B": f65(order["creation_time"].replace(tzinfo=None))})
+        ws.append({"A": f65("Address"), "B": f65(order["address"])})
+        ws.append({"A": f65("Type"), "B": f65(order["type"])})
+        ws.append({"A": f65("Total"), "B": f65(order["total"])})
+        ws.append({"A": f65("Item name"), "B": f65("Price"), "C": f65("Quantity")})
+
+        for item in order["items"]:
+            ws.append({"A": f85(f"{item['manufacturer']} {item['model']}"), "B": f85(item["price"]),
+                       "C": f85(item["quantity"])})
         ws.append({})
-        ws.append({"A": upd_cell(ws("Orders:"), font=Font(bold=True), fill=mkfill("89EB34", .15))})
-        f65 = lambda: mkfill("89EB34", .65)
-        f85 = lambda: mkfill("89EB34", .85)
-        for order in result["orders"]:
-            ws.append({"A": upd_cell(ws("Status"), fill=f65()), "B": upd_cell(ws(order["status"]), fill=f65())})
-            ws.append({"A": upd_cell(ws("Creation Time"), fill=f65()),
-                       "B": upd_cell(ws(order["creation_time"].replace(tzinfo=None)), fill=f65())})
-            ws.append({"A": upd_cell(ws("Address"), fill=f65()), "B": upd_cell(ws(order["address"]), fill=f65())})
-            ws.append({"A": upd_cell(ws("Type"), fill=f65()), "B": upd_cell(ws(order["type"]), fill=f65())})
-            ws.append({"A": upd_cell(ws("Total"), fill=f65()), "B": upd_cell(ws(order["total"]), fill=f65())})
-            ws.append({"A": upd_cell(ws("Item name"), fill=f65()), "B": upd_cell(ws("Price"), fill=f65()),
-                       "C": upd_cell(ws("Quantity"), fill=f65())})
-
-            for item in order["items"]:
-                ws.append({"A": upd_cell(ws(f"{item['manufacturer']} {item['model']}"), fill=f85()),
-                           "B": upd_cell(ws(item["price"]), fill=f85()),
-                           "C": upd_cell(ws(item["quantity"]), fill=f85())})
-            ws.append({})
-
-        ws.append({"A": upd_cell(ws("Returns:"), font=Font(bold=True), fill=mkfill("89EB34", .15))})
-        ws.append({"A": upd_cell(ws("Item name"), fill=f65()), "B": upd_cell(ws("Quantity"), fill=f65()),
-                   "C": upd_cell(ws("Time"), fill=f65()), "D": upd_cell(ws("Price (per item)"), fill=f65())})
-        for ret in result["returns"]:
-            ws.append({"A": upd_cell(ws(f"{ret['item']['manufacturer']} {ret['item']['model']}"), fill=f85()),
-                       "B": upd_cell(ws(ret["quantity"]), fill=f85()),
-                       "C": upd_cell(ws(ret["time"].replace(tzinfo=None)), fill=f85()),
-                       "D": upd_cell(ws(ret["item"]["price"]), fill=f85())})
-
-        ws.fix_formatting()
-        fp = BytesIO()
-        setattr(fp, "name", f"customer-{customer.id}-report.xlsx")
-        wb.save(fp)
-        return Response(content=fp.getvalue(), media_type="application/vnd.ms-excel")
 
-    return result
+    ws.append({"A": title("Returns:")})
+    ws.append({"A": f65("Item name"), "B": f65("Quantity"), "C": f65("Time"), "D": f65("Price (per item)")})
+    for ret in result["returns"]:
+        ws.append({"A": f85(f"{ret['item']['manufacturer']} {ret['item']['model']}"), "B": f85(ret["quantity"]),
+                   "C": f85(ret["time"].replace(tzinfo=None)), "D": f85(ret["item"]["price"])})
 
+    return ws
 
-@router.get("/categories/{category_id}")
-async def category_report(manager: AuthManagerDep, category_id: int, fmt: Literal["json", "excel"]="json"):
-    if not Permissions.check(manager, Permissions.READ_REPORTS):
-        raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    category = await Category.get_or_none(id=category_id)
+async def category_report_data(category_id: int, page: int = 0, limit: int = 0, products: bool = True) -> dict:
+    if (category := await Category.get_or_none(id=category_id)) is None:
+        raise HTTPException(status_code=404, detail="Unknown category!")
+
+    conn = connections.get("default")
+    query = (
+        "SELECT COUNT(*) AS product_count, COALESCE(SUM(product.quantity), 0) AS product_quantity, "
+        "COALESCE(AVG(product.price), 0) AS product_average_price, ("
+        "    SELECT COUNT(DISTINCT orderitem.order_id) FROM orderitem "
+        "    INNER JOIN product ON product.id = orderitem.product_id WHERE product.category_id = %s"
+        ") AS order_count "
+        "FROM product WHERE product.category_id = %s;"
+    )
+    stats = (await conn.execute_query_dict(query, [category.id, category.id]))[0]
 
     result = {
         "id": category.id,
         "name": category.name,
         "description": category.description,
-        "product_count": 0,
-        "order_count": 0,
-        "product_quantity": 0,
-        "product_average_price": 0,
+        "product_count": stats["product_count"],
+        "order_count": stats["order_count"],
+        "product_quantity": int(stats["product_quantity"]),
+        "product_average_price": stats["product_average_price"],
         "products": [],
     }
 
-    products = await Product.filter(category=category).all()
-    result["product_count"] = len(products)
-    for product in products:
-        result["product_quantity"] += product.quantity
-        result["product_average_price"] += product.price
-        result["products"].append((await ProductPd.from_tortoise_orm(product)).model_dump())
+    if products:
+        query = Product.filter(category=category).order_by("id")
+        if limit > 0:
+            query = query.limit(limit).offset(page * limit)
+        result["products"] = await run_in_threadpool(products_report, await query)
+
+    return result
+
+
+async def category_report_xlsx(result: dict) -> XlsxWriter:
+    ws = XlsxWriter(f"category-{result['id']}-report.xlsx")
+    ws.append({"A": "REPORT GENERATED AT", "B": datetime.now()})
+    ws.append({})
+    ws.append({"A": "Category Id:", "B": result["id"]})
+    ws.append({"A": "Category Name:", "B": result["name"]})
+    ws.append({"A": "Category Description:", "B": result["description"]})
+    ws.append({})
+    ws.append({"A": "Product count:", "B": result["product_count"]})
+    ws.append({"A": "Order count:", "B": result["order_count"]})
+    ws.append({"A": "Product quantity:", "B": result["product_quantity"]})
+    ws.append({"A": "Product average price:", "B": result["product_average_price"]})
+    ws.append({})
+    ws.append({"A": "Products:"})
+    ws.append({})
+    ws.append({"A": "Model", "B": "Manufacturer", "C": "Price", "D": "Quantity", "E": "Limit Per order",
+               "F": "Warranty Days"})
+    async for chunk in iter_chunks(Product.filter(category__id=result["id"])):
+        await run_in_threadpool(write_category_products, ws, chunk)
+
+    return ws
+
+
+def write_category_products(ws: XlsxWriter, products: list[Product]) -> None:
+    for prod in products:
+        ws.append({"A": prod.model, "B": prod.manufacturer, "C": prod.price, "D": prod.quantity,
+                   "E": prod.per_order_limit, "F": prod.warranty_days})
+
+
+async def make_report(report: ReportType, entity_id: int, fmt: ReportFormat) -> dict | XlsxWriter:
+    if report == "products":
+        result, render = await product_report_data(entity_id), product_report_xlsx
+    elif report == "customers":
+        result, render = await customer_report_data(entity_id), customer_report_xlsx
+    else:
+        result, render = await category_report_data(entity_id, products=fmt == "json"), category_report_xlsx
+
+    return await render(result) if fmt == "excel" else result
 
-    result["order_count"] = await Order.filter(orderitems__product__id__in=[prod.id for prod in products]).count()
-    result["product_average_price"] /= result["product_count"]
+
+# Product reports show the category name and customer reports show products of ordered items, other data
+# of reports is versioned by the report entity (see writes which call bump_versions).
+def report_version_keys(report: ReportType, entity_id: int) -> tuple[str, ...]:
+    if report == "products":
+        return version_key(Product, entity_id), version_key(Category)
+    if report == "customers":
+        return version_key(Customer, entity_id), version_key(Product)
+    return (version_key(Category, entity_id),)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+# Reports depend on current date (e.g. monthly averages of the last year), so it's a part of the version too.
+async def cached_report(request: Request, report: ReportType, entity_id: int, fmt: ReportFormat,
+                        build: Callable[[], Awaitable[dict | XlsxWriter]], *key: Any) -> Response:
+    version = await data_version(*report_version_keys(report, entity_id))
+    key = ":".join(map(str, (report, entity_id, fmt, *key, date.today(), version)))
+    headers = {"ETag": f"\"{sha256(key.encode()).hexdigest()[:32]}\""}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if (cached := ReportCache.get(key)) is None:
+        cached = await ReportCache.put(key, await build())
+
+    path, media_type, filename = cached
+    return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
+
+
+@router.get("/products/{product_id}")
+async def product_report(request: Request, manager: AuthManagerDep, product_id: int, fmt: ReportFormat="json"):
+    if not Permissions.check(manager, Permissions.READ_REPORTS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    return await cached_report(request, "products", product_id, fmt,
+                               lambda: make_report("products", product_id, fmt))
+
+
+@router.get("/customers/{customer_id}")
+async def customer_report(request: Request, manager: AuthManagerDep, customer_id: int, fmt: ReportFormat="json"):
+    if not Permissions.check(manager, Permissions.READ_REPORTS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    return await cached_report(request, "customers", customer_id, fmt,
+                               lambda: make_report("customers", customer_id, fmt))
+
+
+@router.get("/categories/{category_id}")
+async def category_report(request: Request, manager: AuthManagerDep, category_id: int, fmt: ReportFormat="json",
+                          page: int = 0, limit: int = 0):
+    if not Permissions.check(manager, Permissions.READ_REPORTS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
     if fmt == "excel":
-        wb = Workbook()
-        ws = CustomWorksheet(wb.active)
-        ws.append({"A": "REPORT GENERATED AT", "B": datetime.now()})
-        ws.append({})
-        ws.append({"A": "Category Id:", "B": category_id})
-        ws.append({"A": "Category Name:", "B": category.name})
-        ws.append({"A": "Category Description:", "B": category.description})
-        ws.append({})
-        ws.append({"A": "Product count:", "B": result["product_count"]})
-        ws.append({"A": "Order count:", "B": result["order_count"]})
-        ws.append({"A": "Product quantity:", "B": result["product_quantity"]})
-        ws.append({"A": "Product average price:", "B": result["product_average_price"]})
-        ws.append({})
-        ws.append({"A": "Products:"})
-        ws.append({})
-        ws.append({"A": "Model", "B": "Manufacturer", "C": "Price", "D": "Quantity", "E": "Limit Per order",
-                   "F": "Warranty Days"})
-        for prod in result["products"]:
-            ws.append({"A": prod["model"], "B": prod["manufacturer"], "C": prod["price"], "D": prod["quantity"],
-                       "E": prod["per_order_limit"], "F": prod["warranty_days"]})
-
-        ws.fix_formatting()
-        fp = BytesIO()
-        setattr(fp, "name", f"category-{category.id}-report.xlsx")
-        wb.save(fp)
-        return Response(content=fp.getvalue(), media_type="application/vnd.ms-excel")
+        return await cached_report(request, "categories", category_id, fmt,
+                                   lambda: make_report("categories", category_id, fmt))
 
-    return result
+    return await cached_report(request, "categories", category_id, fmt,
+                               lambda: category_report_data(category_id, page, limit), page, limit)
+
+
+@router.post("/jobs")
+async def create_report_job(data: ReportJobCreateModel, manager: AuthManagerDep):
+    if not Permissions.check(manager, Permissions.READ_REPORTS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    job = ReportJobs.submit(manager.id, lambda: make_report(data.type, data.id, data.fmt))
+    return job.to_dict()
+
+
+async def get_job(job_id: str, manager: Manager) -> ReportJob:
+    if not Permissions.check(manager, Permissions.READ_REPORTS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    job = ReportJobs.get(job_id)
+    if job is None or (job.manager_id != manager.id and not Permissions.check(manager, Permissions.ADMIN)):
+        raise HTTPException(status_code=404, detail="Unknown job!")
+
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_report_job(job_id: str, manager: AuthManagerDep):
+    return (await get_job(job_id, manager)).to_dict()
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_report_job(job_id: str, manager: AuthManagerDep):
+    job = await get_job(job_id, manager)
+    if job.status != "done":
+        raise HTTPException(status_code=400, detail="Report is not ready yet!")
+
+    return FileResponse(job.path, media_type=job.media_type, filename=job.filename)
@@ -1,21 +1,32 @@
 from fastapi import APIRouter, HTTPException
+from tortoise.transactions import in_transaction
 
-from app.models import Return
+from app.cache import invalidate, bump_versions, version_key
+from app.exports import export_search
+from app.models import Customer, Return, DailySales, CustomerStats, CustomerSpendDay
 from app.models.customer import CustomerPd
 from app.models.order import Order
 from app.models.order_item import OrderItemPd
 from app.models.product import ProductPd
-from app.schemas import SearchData
+from app.rollups import record_return
+from app.schemas import SearchData, ExportFormat
 from app.schemas.returns import ReturnCreateModel, ReturnUpdateModel
-from app.utils import AuthManagerDep, Permissions, search
+from app.utils import AuthManagerDep, Permissions, search, paginate
 
 router = APIRouter(prefix="/api/v0/returns")
 
 
 @router.post("/search")
 async def search_return(data: SearchData):
-    query, countQuery = search(Return, data)
-    return {"results": [await return_to_resp(ret) for ret in await query], "count": await countQuery.count()}
+    query, orderings = search(Return, data)
+    resp = await paginate(query, data.pagination, orderings)
+    resp["results"] = [await return_to_resp(ret) for ret in resp["results"]]
+    return resp
+
+
+@router.post("/search/export")
+async def export_returns(data: SearchData, manager: AuthManagerDep, fmt: ExportFormat = "csv"):
+    return await export_search(Return, data, fmt)
 
 
 @router.post("/")
@@ -31,7 +42,13 @@ async def create_return(data: ReturnCreateModel, manager: AuthManagerDep):
     if data.quantity > product.orderitems.quantity:
         raise HTTPException(status_code=400, detail="Return quantity cannot be bigger than order quantity!")
 
-    ret = await Return.create(quantity=data.quantity, reason=data.reason, order=order, order_item=product.orderitems)
+    async with in_transaction() as conn:
+        ret = await Return.create(quantity=data.quantity, reason=data.reason, order=order,
+                                  order_item=product.orderitems, using_db=conn)
+        await record_return(conn, ret, ret.quantity, True)
+        await bump_versions(version_key(Customer, order.customer_id), using_db=conn)
+
+    invalidate(Return, DailySales, CustomerStats, CustomerSpendDay)
     return await return_to_resp(ret)
 
 
@@ -64,8 +81,16 @@ async def update_return(return_id: int, data: ReturnUpdateModel, manager: AuthMa
     if not Permissions.check(manager, Permissions.MANAGE_ORDERS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
-    if (ret := await Return.get_or_none(id=return_id)) is None:
-        raise HTTPException(status_code=404, detail="Unknown return!")
+    async with in_transaction() as conn:
+        query = Return.filter().select_related("order", "order_item").select_for_update().using_db(conn)
+        if (ret := await query.get_or_none(id=return_id)) is None:
+            raise HTTPException(status_code=404, detail="Unknown return!")
+
+        old_quantity = ret.quantity
+        await ret.update(**data.model_dump(exclude_defaults=True), using_db=conn)
+        if ret.quantity != old_quantity:
+            await record_return(conn, ret, ret.quantity - old_quantity, False)
+        await bump_versions(version_key(Customer, ret.order.customer_id), using_db=conn)
 
-    await ret.update(**data.model_dump(exclude_defaults=True))
+    invalidate(Return, DailySales, CustomerStats, CustomerSpendDay)
     return await return_to_resp(ret)
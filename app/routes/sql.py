@@ -1,36 +1,239 @@
+import json
+import os
+import re
+from contextlib import AsyncExitStack
 from datetime import date, datetime
-from typing import Any
+from decimal import Decimal
+from time import perf_counter
+from typing import Any, AsyncIterator
 
+from asyncmy.cursors import SSDictCursor
+from asyncmy.errors import MySQLError
 from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from tortoise import connections
+from tortoise.exceptions import OperationalError
 
-from app.schemas.sql import ExecuteSql
+from app.cache import invalidate, bump_versions, ALL_DATA
+from app.rollups import RollupRebuilder
+from app.schemas.sql import ExecuteSql, ProfileSql
 from app.utils import AuthManagerDep, Permissions
 
 router = APIRouter(prefix="/api/v0/sql")
 
+SQL_MAX_ROWS = int(os.environ.get("SQL_MAX_ROWS", 100_000))
+SQL_MAX_BYTES = int(os.environ.get("SQL_MAX_BYTES", 64 * 1024 * 1024))
+SAMPLE_SIZE = 100
+FETCH_SIZE = 1000
+READ_QUERY_RE = re.compile(r"^\s*(select|with|table)\b", re.IGNORECASE)
+WRITE_KEYWORDS_RE = re.compile(r"\b(insert|update|delete|replace)\b", re.IGNORECASE)
+
 
 def get_js_type(value: Any) -> str:
-    if isinstance(value, (int, float)):
+    if isinstance(value, (int, float, Decimal)):
         return "number"
     elif isinstance(value, (datetime, date)):
         return "date"
     return "string"
 
 
+# Column type is the type of all non-null sampled values, columns with mixed or unknown types are strings.
+def infer_columns(names: list[str], sample: list[dict]) -> list[dict]:
+    columns = []
+    for name in names:
+        types = {get_js_type(row[name]) for row in sample if row[name] is not None}
+        columns.append({"name": name, "type": types.pop() if len(types) == 1 else "string"})
+
+    return columns
+
+
+# Multiple statements are never treated as read-only, even if the first one is a select.
+def is_read_query(query: str) -> bool:
+    query = query.strip().rstrip(";")
+    if READ_QUERY_RE.match(query) is None or ";" in query:
+        return False
+    return not WRITE_KEYWORDS_RE.search(query) if query[:4].lower() == "with" else True
+
+
+# Reads query results with a server-side cursor, so rows are fetched from the database in FETCH_SIZE batches
+# instead of loading the whole result. Reading stops after max_rows rows or max_bytes bytes of encoded rows.
+class QueryStream:
+    def __init__(self, query: str, max_rows: int, max_bytes: int):
+        self.query = query
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.columns: list[dict] = []
+        self.row_count = 0
+        self.size = 0
+        self.truncated = False
+        self._stack = AsyncExitStack()
+        self._connection = None
+        self._cursor = None
+        self._sample: list[dict] = []
+
+    async def open(self) -> None:
+        try:
+            self._connection = await self._stack.enter_async_context(
+                connections.get("default").acquire_connection())
+            self._cursor = self._connection.cursor(SSDictCursor)
+            await self._cursor.execute(self.query)
+            if not is_read_query(self.query):
+                await bump_versions(ALL_DATA)
+                RollupRebuilder.schedule()
+                invalidate()
+            self._sample = list(await self._cursor.fetchmany(SAMPLE_SIZE))
+        except MySQLError as e:
+            await self._stack.aclose()
+            raise HTTPException(status_code=400, detail=str(e))
+        except BaseException:
+            await self._close(False)
+            raise
+
+        names = [column[0] for column in self._cursor.description or ()]
+        self.columns = infer_columns(names, self._sample)
+
+    async def batches(self) -> AsyncIterator[list[str]]:
+        finished = False
+        try:
+            rows, self._sample = self._sample, []
+            while rows:
+                batch = []
+                for row in rows:
+                    line = json.dumps(jsonable_encoder(row))
+                    if self.row_count >= self.max_rows or self.size + len(line) > self.max_bytes:
+                        self.truncated = True
+                        break
+                    self.row_count += 1
+                    self.size += len(line)
+                    batch.append(line)
+                if batch:
+                    yield batch
+                if self.truncated:
+                    break
+                rows = await self._cursor.fetchmany(FETCH_SIZE)
+            finished = not self.truncated
+        finally:
+            await self._close(finished)
+
+    # Closing a server-side cursor reads the rest of the result, so if the result wasn't read to the end (rows
+    # were truncated or the client disconnected) the query is killed and the connection is closed instead of
+    # being returned to the pool.
+    async def _close(self, finished: bool) -> None:
+        try:
+            if finished:
+                await self._cursor.close()
+            elif self._connection is not None:
+                try:
+                    await connections.get("default").execute_query(f"KILL QUERY {int(self._connection.thread_id())};")
+                except OperationalError:
+                    pass
+                self._connection.close()
+                await self._connection.ensure_closed()
+        finally:
+            await self._stack.aclose()
+
+    def _footer(self) -> dict:
+        return {"truncated": self.truncated, "row_count": self.row_count}
+
+    async def json(self) -> AsyncIterator[str]:
+        yield f'{{"columns": {json.dumps(self.columns)}, "result": ['
+        first = True
+        async for batch in self.batches():
+            yield ("" if first else ",") + ",".join(batch)
+            first = False
+        yield f'], {json.dumps(self._footer())[1:]}'
+
+    async def ndjson(self) -> AsyncIterator[str]:
+        yield json.dumps({"columns": self.columns}) + "\n"
+        async for batch in self.batches():
+            yield "\n".join(batch) + "\n"
+        yield json.dumps(self._footer()) + "\n"
+
+
 @router.post("/")
 async def execute_sql(data: ExecuteSql, manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.ADMIN):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
+    stream = QueryStream(data.query, min(data.max_rows or SQL_MAX_ROWS, SQL_MAX_ROWS),
+                         min(data.max_bytes or SQL_MAX_BYTES, SQL_MAX_BYTES))
+    await stream.open()
+    if data.format == "ndjson":
+        return StreamingResponse(stream.ndjson(), media_type="application/x-ndjson")
+    if data.stream:
+        return StreamingResponse(stream.json(), media_type="application/json")
+
+    return Response("".join([chunk async for chunk in stream.json()]), media_type="application/json")
+
+
+# Walks json plan and returns tables which are read with full scans or without any usable index.
+def plan_warnings(plan: Any) -> list[dict]:
+    warnings = []
+    if isinstance(plan, list):
+        for item in plan:
+            warnings.extend(plan_warnings(item))
+        return warnings
+    if not isinstance(plan, dict):
+        return warnings
+
+    if "table_name" in plan and "access_type" in plan:
+        issues = []
+        if plan["access_type"] == "ALL":
+            issues.append("Full table scan")
+        if plan["access_type"] in ("ALL", "index") and not plan.get("possible_keys"):
+            issues.append("No usable index")
+        if issues:
+            warnings.append({
+                "table": plan["table_name"],
+                "access_type": plan["access_type"],
+                "rows": plan.get("rows_examined_per_scan"),
+                "possible_keys": plan.get("possible_keys"),
+                "key": plan.get("key"),
+                "condition": plan.get("attached_condition"),
+                "issues": issues,
+            })
+
+    for value in plan.values():
+        if isinstance(value, (dict, list)):
+            warnings.extend(plan_warnings(value))
+
+    return warnings
+
+
+async def timed_query(query: str) -> tuple[list[dict], float]:
     conn = connections.get("default")
-    result = await conn.execute_query_dict(data.query)
-    columns = []
-    if result:
-        for key in result[0]:
-            columns.append({"name": key, "type": get_js_type(result[0][key])})
+    start = perf_counter()
+    try:
+        result = await conn.execute_query_dict(query)
+    except OperationalError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result, round((perf_counter() - start) * 1000, 3)
+
+
+# Returns json plan of the query and, for read-only queries, EXPLAIN ANALYZE output (which executes the query,
+# so its timing is the query execution time).
+@router.post("/profile")
+async def profile_sql(data: ProfileSql, manager: AuthManagerDep):
+    if not Permissions.check(manager, Permissions.ADMIN):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    query = data.query.strip().rstrip(";")
+    result, explain_time = await timed_query(f"EXPLAIN FORMAT=JSON {query}")
+    plan = json.loads(next(iter(result[0].values()))) if result else None
+    resp = {
+        "plan": plan,
+        "warnings": plan_warnings(plan),
+        "analyze": None,
+        "timings": {"explain_ms": explain_time, "analyze_ms": None},
+    }
+
+    if data.analyze and is_read_query(query):
+        result, analyze_time = await timed_query(f"EXPLAIN ANALYZE {query}")
+        resp["analyze"] = next(iter(result[0].values())) if result else None
+        resp["timings"]["analyze_ms"] = analyze_time
 
-    return {"result": result, "columns": columns}
+    return resp
 
 
 """
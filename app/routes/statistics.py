@@ -1,13 +1,28 @@
-from fastapi import APIRouter, HTTPException
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
 from tortoise import connections
 
-from app.models import Characteristic, ProductCharacteristic
+from app.migrations import advisory_lock, column_indexed
+from app.models import Characteristic, ProductCharacteristic, Order
+from app.rollups import rebuild_rollups
 from app.models.product import Product
 from app.schemas.products import ProductCreateModel, ProductUpdateModel, PutCharacteristic
+from app.schemas.statistics import Granularity, TopWindow, TopSort
 from app.utils import AuthManagerDep, Permissions
 
 router = APIRouter(prefix="/api/v0/statistics")
 
+MAX_BUCKETS = 2000
+TOP_WINDOWS = {"30d": "30 DAY", "1y": "1 YEAR"}
+BUCKETS_SQL = {
+    "hour": "TIMESTAMP(DATE(`order`.creation_time), MAKETIME(HOUR(`order`.creation_time), 0, 0))",
+    "day": "TIMESTAMP(DATE(`order`.creation_time))",
+    "week": "TIMESTAMP(DATE(`order`.creation_time) - INTERVAL WEEKDAY(`order`.creation_time) DAY)",
+    "month": "TIMESTAMP(DATE(`order`.creation_time) - INTERVAL (DAYOFMONTH(`order`.creation_time) - 1) DAY)",
+}
+
 
 @router.get("/customers/{customer_id}")
 async def customer_statistics(manager: AuthManagerDep, customer_id: int):
@@ -60,27 +75,48 @@ async def categories_statistics(manager: AuthManagerDep, category_id: int):
     return await conn.execute_query_dict(query, [category_id])
 
 
+# Customer totals are read from customerstats (all time) or summed from customerspendday buckets (rolling windows),
+# both are updated together with orders and returns.
 @router.get("/customers-top")
-async def customers_top(manager: AuthManagerDep, count: int = 100):
+async def customers_top(manager: AuthManagerDep, count: int = 100, window: TopWindow = "all", by: TopSort = "items"):
     if count < 1:
         count = 10
     if not Permissions.check(manager, Permissions.READ_STATISTICS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
+    order = "total_money DESC" if by == "money" else "order_items DESC, total_money DESC"
+    if window == "all":
+        spend = f"SELECT customer_id, order_items, total_money FROM customerstats ORDER BY {order} LIMIT %s"
+    else:
+        spend = (
+            "SELECT customer_id, SUM(order_items) AS order_items, SUM(total_money) AS total_money "
+            "FROM customerspendday "
+            f"WHERE day > CURDATE() - INTERVAL {TOP_WINDOWS[window]} "
+            f"GROUP BY customer_id ORDER BY {order} LIMIT %s"
+        )
+
     conn = connections.get("default")
     query = (
         "SELECT customer.id, customer.first_name, customer.last_name, customer.email, customer.phone_number, "
-        "COUNT(orderitem.id) AS order_items, SUM(orderitem.price * orderitem.quantity) AS total_money "
-        "FROM customer "
-        "INNER JOIN `order` ON customer.id = `order`.customer_id "
-        "INNER JOIN orderitem on `order`.id = orderitem.order_id "
-        "WHERE `order`.creation_time > `order`.creation_time - INTERVAL 1 YEAR "
-        "GROUP BY customer.id, customer.first_name, customer.last_name, customer.email, customer.phone_number "
-        "ORDER BY COUNT(orderitem.id) DESC, SUM(orderitem.price * orderitem.quantity) DESC LIMIT %s;"
+        "spend.order_items, spend.total_money "
+        f"FROM ({spend}) spend "
+        "INNER JOIN customer ON customer.id = spend.customer_id "
+        f"ORDER BY {order};"
     )
     return await conn.execute_query_dict(query, [count])
 
 
+# Rollups are rebuilt automatically after deletes which cascade to orders and sql console writes, this endpoint
+# repairs them after changes done directly in the database.
+@router.post("/rollups/rebuild", status_code=204)
+async def rebuild_statistics_rollups(manager: AuthManagerDep):
+    if not Permissions.check(manager, Permissions.ADMIN):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    await rebuild_rollups()
+
+
+# Time statistics are read from the dailysales rollup, which is updated together with orders and returns.
 @router.get("/time/year")
 async def last_year_statistics(manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.READ_STATISTICS):
@@ -88,28 +124,90 @@ async def last_year_statistics(manager: AuthManagerDep):
 
     conn = connections.get("default")
     query = (
-        "SELECT MONTH(`order`.creation_time) as month, COUNT(DISTINCT `order`.id) AS order_count, "
-        "SUM(orderitem.price*orderitem.quantity) AS total_money "
-        "FROM `order` "
-        "INNER JOIN orderitem ON `order`.id=orderitem.order_id "
-        "WHERE `order`.creation_time > `order`.creation_time - INTERVAL 1 YEAR "
-        "GROUP BY month ORDER BY month;"
+        "SELECT YEAR(day) AS year, MONTH(day) AS month, SUM(order_count) AS order_count, "
+        "SUM(total_money) AS total_money "
+        "FROM dailysales "
+        "WHERE day > CURDATE() - INTERVAL 1 YEAR AND order_count > 0 "
+        "GROUP BY year, month ORDER BY year, month;"
     )
     return await conn.execute_query_dict(query)
 
 
 @router.get("/time/month")
-async def last_year_statistics(manager: AuthManagerDep):
+async def last_month_statistics(manager: AuthManagerDep):
     if not Permissions.check(manager, Permissions.READ_STATISTICS):
         raise HTTPException(status_code=403, detail="Insufficient privileges!")
 
     conn = connections.get("default")
     query = (
-        "SELECT DAY(`order`.creation_time) as day, COUNT(DISTINCT `order`.id) AS order_count, "
-        "SUM(orderitem.price*orderitem.quantity) AS total_money "
-        "FROM `order` "
-        "INNER JOIN orderitem ON `order`.id=orderitem.order_id "
-        "WHERE `order`.creation_time > `order`.creation_time - INTERVAL 1 MONTH "
-        "GROUP BY day ORDER BY day;"
+        "SELECT dailysales.day AS date, DAY(dailysales.day) AS day, order_count, total_money "
+        "FROM dailysales "
+        "WHERE dailysales.day > CURDATE() - INTERVAL 1 MONTH AND dailysales.order_count > 0 "
+        "ORDER BY dailysales.day;"
     )
     return await conn.execute_query_dict(query)
+
+
+def bucket_start(time: datetime, granularity: Granularity) -> datetime:
+    time = time.replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return time
+    time = time.replace(hour=0)
+    if granularity == "week":
+        return time - timedelta(days=time.weekday())
+    if granularity == "month":
+        return time.replace(day=1)
+    return time
+
+
+def next_bucket(time: datetime, granularity: Granularity) -> datetime:
+    if granularity == "month":
+        return (time.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return time + {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}[granularity]
+
+
+# generate_schemas doesn't change existing tables, so the creation_time index (used by range filters of time series)
+# is created on startup if missing.
+async def ensure_order_time_index() -> None:
+    async with advisory_lock("cw_order_time_index"):
+        if not await column_indexed(Order, "creation_time"):
+            await connections.get("default").execute_query(
+                "ALTER TABLE `order` ADD INDEX idx_order_creation_time (creation_time);")
+
+
+# Order statistics for [from, to) split into buckets, buckets without orders are returned with zero values.
+@router.get("/time/series")
+async def time_series_statistics(manager: AuthManagerDep, granularity: Granularity = "day",
+                                 from_: Optional[datetime] = Query(default=None, alias="from"),
+                                 to: Optional[datetime] = None):
+    if not Permissions.check(manager, Permissions.READ_STATISTICS):
+        raise HTTPException(status_code=403, detail="Insufficient privileges!")
+
+    # Order times are stored in local time, aware datetimes (e.g. "...Z") are converted before tzinfo is dropped.
+    to = (to or datetime.now()).astimezone().replace(tzinfo=None)
+    from_ = (from_ or to - timedelta(days=30)).astimezone().replace(tzinfo=None)
+    if from_ >= to:
+        raise HTTPException(status_code=400, detail="\"from\" must be earlier than \"to\"!")
+
+    buckets = []
+    bucket = bucket_start(from_, granularity)
+    while bucket < to:
+        if len(buckets) >= MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Too many buckets, maximum is {MAX_BUCKETS}!")
+        buckets.append(bucket)
+        bucket = next_bucket(bucket, granularity)
+
+    conn = connections.get("default")
+    query = (
+        f"SELECT {BUCKETS_SQL[granularity]} AS time, COUNT(DISTINCT `order`.id) AS order_count, "
+        "COALESCE(SUM(orderitem.quantity), 0) AS item_count, "
+        "COALESCE(SUM(orderitem.price * orderitem.quantity), 0) AS total_money "
+        "FROM `order` "
+        "LEFT JOIN orderitem ON `order`.id = orderitem.order_id "
+        "WHERE `order`.creation_time >= %s AND `order`.creation_time < %s "
+        "GROUP BY time;"
+    )
+    rows = {row["time"]: row for row in await conn.execute_query_dict(query, [from_, to])}
+
+    return [rows.get(bucket, {"time": bucket, "order_count": 0, "item_count": 0, "total_money": 0})
+            for bucket in buckets]
@@ -1,4 +1,4 @@
-from typing import Literal
+from typing import Literal, Optional
 
 from pydantic import BaseModel
 
@@ -6,6 +6,8 @@ from pydantic import BaseModel
 class PaginationModel(BaseModel):
     page: int = 0
     pageSize: int = 10
+    cursor: Optional[str] = None
+    estimate: bool = False
 
 
 class FilterItem(BaseModel):
@@ -29,3 +31,6 @@ class SearchData(BaseModel):
     pagination: PaginationModel
     filter: FilterModel
     sort: list[SortItem]
+
+
+ExportFormat = Literal["csv", "xlsx"]
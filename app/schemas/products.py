@@ -1,6 +1,8 @@
-from typing import Optional
+from typing import Optional, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from app.schemas import PaginationModel
 
 
 class ProductCreateModel(BaseModel):
@@ -27,3 +29,35 @@ class ProductUpdateModel(BaseModel):
 
 class PutCharacteristic(BaseModel):
     value: str | int | float | bool
+
+
+class FacetFilter(BaseModel):
+    characteristic_id: int
+    values: Optional[list[str | int | float | bool]] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+
+class FacetSearchModel(BaseModel):
+    pagination: PaginationModel = PaginationModel()
+    category_id: Optional[int] = None
+    filters: list[FacetFilter] = []
+    facets: Optional[list[int]] = None
+
+
+class ProductIdsModel(BaseModel):
+    ids: list[int] = Field(max_length=1000)
+
+
+ImportFormat = Literal["csv", "xlsx"]
+
+
+class ProductImportRow(BaseModel):
+    model: str = Field(min_length=1, max_length=128)
+    manufacturer: str = Field(min_length=1, max_length=128)
+    price: Optional[float] = Field(default=None, ge=0)
+    quantity: Optional[int] = Field(default=None, ge=0)
+    per_order_limit: Optional[int] = Field(default=None, ge=0)
+    image_url: Optional[str] = None
+    warranty_days: Optional[int] = Field(default=None, ge=0)
+    category: Optional[str] = Field(default=None, max_length=200)
@@ -0,0 +1,12 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+ReportType = Literal["products", "customers", "categories"]
+ReportFormat = Literal["json", "excel"]
+
+
+class ReportJobCreateModel(BaseModel):
+    type: ReportType
+    id: int
+    fmt: ReportFormat = "json"
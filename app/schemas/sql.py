@@ -1,5 +1,16 @@
-from pydantic import BaseModel
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field
 
 
 class ExecuteSql(BaseModel):
     query: str
+    format: Literal["json", "ndjson"] = "json"
+    stream: bool = False
+    max_rows: Optional[int] = Field(default=None, ge=1)
+    max_bytes: Optional[int] = Field(default=None, ge=1)
+
+
+class ProfileSql(BaseModel):
+    query: str
+    analyze: bool = True
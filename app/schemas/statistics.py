@@ -0,0 +1,5 @@
+from typing import Literal
+
+Granularity = Literal["hour", "day", "week", "month"]
+TopWindow = Literal["all", "30d", "1y"]
+TopSort = Literal["items", "money"]
@@ -1,13 +1,23 @@
-from typing import Union, Annotated, Type
+import hmac
+import json
+import os
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from functools import lru_cache
+from hashlib import sha256
+from time import time, monotonic
+from typing import Union, Annotated, Type, Optional, Any, AsyncIterator
 from uuid import UUID
 
 from fastapi import Request, HTTPException, Depends
 from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
 
+from app.cache import cached_count
 from app.models._utils import Model
 from app.models.manager import Manager
 from app.models.session import Session
-from app.schemas import SearchData
+from app.schemas import SearchData, PaginationModel, FilterItem
 
 
 class Permissions:
@@ -27,20 +37,92 @@ class Permissions:
         return manager.permissions & Permissions.ADMIN == Permissions.ADMIN or manager.permissions & perm == perm
 
 
+SECRET_KEY = os.environ.get("SECRET_KEY", "").encode()
+TOKEN_TTL = 60 * 60 * 24 * 7
+SESSION_CHECK_INTERVAL = 60
+SESSION_CHECK_CACHE_SIZE = 10000
+
+
+# Tokens have "{session_id}.{manager_id}.{permissions}.{issued_at}.{signature}" format. Signature and expiration are
+# verified without database queries, the session, its manager and the manager's permissions are rechecked at most
+# every SESSION_CHECK_INTERVAL seconds, so deleted sessions and changed permissions (by other workers or directly
+# in the database) stop working after that interval.
+class SessionTokens:
+    checked_sessions: dict[tuple[int, int, int], float] = {}
+    revoked_sessions: dict[int, float] = {}
+
+    @staticmethod
+    def sign(payload: str) -> str:
+        return urlsafe_b64encode(hmac.new(SECRET_KEY, payload.encode(), sha256).digest()).decode().rstrip("=")
+
+    @classmethod
+    def make(cls, session: Session, manager: Manager) -> str:
+        payload = f"{session.id}.{manager.id}.{manager.permissions}.{int(time())}"
+        return f"{payload}.{cls.sign(payload)}"
+
+    @classmethod
+    def verify(cls, token: str) -> tuple[int, int, int]:
+        payload, _, signature = token.rpartition(".")
+        if not hmac.compare_digest(signature.encode(), cls.sign(payload).encode()):
+            raise ValueError
+
+        sid, uid, permissions, issued_at = map(int, payload.split("."))
+        if issued_at + TOKEN_TTL < time() or sid in cls.revoked_sessions:
+            raise ValueError
+
+        return sid, uid, permissions
+
+    @classmethod
+    async def check_session(cls, session_id: int, manager_id: int, permissions: int) -> None:
+        key = (session_id, manager_id, permissions)
+        now = monotonic()
+        if cls.checked_sessions.get(key, 0) > now:
+            return
+        if not await Session.exists(id=session_id, manager__id=manager_id, manager__permissions=permissions):
+            cls.checked_sessions.pop(key, None)
+            raise ValueError
+
+        cls.checked_sessions[key] = now + SESSION_CHECK_INTERVAL
+        if len(cls.checked_sessions) > SESSION_CHECK_CACHE_SIZE:
+            cls.checked_sessions = {key: until for key, until in cls.checked_sessions.items() if until > now}
+
+    @classmethod
+    def revoke_session(cls, session_id: int) -> None:
+        now = time()
+        cls.checked_sessions = {key: until for key, until in cls.checked_sessions.items() if key[0] != session_id}
+        cls.revoked_sessions[session_id] = now
+        for sid, revoked_at in list(cls.revoked_sessions.items()):
+            if revoked_at + TOKEN_TTL < now:
+                del cls.revoked_sessions[sid]
+
+    # Tokens must be accepted by every worker and survive restarts, so the key can't be generated per process.
+    @staticmethod
+    def check_key() -> None:
+        if not SECRET_KEY:
+            raise RuntimeError("SECRET_KEY environment variable is not set!")
+
+
 async def authManager(request: Request, session_: bool=False) -> Union[Manager, Session]:
     if not (auth := request.headers.get("authorization")):
         raise HTTPException(status_code=401, detail="No such session!")
 
     try:
-        sid, uid, key = auth.split(".")
-        uid = int(uid)
-        sid = int(sid)
-        key = UUID(key)
+        if auth.count(".") == 2:
+            sid, uid, key = auth.split(".")
+            uid = int(uid)
+            sid = int(sid)
+            key = UUID(key)
 
-        if (session := await Session.get_or_none(id=sid, manager__id=uid, token=key).select_related("manager")) is None:
-            raise ValueError
+            query = Session.get_or_none(id=sid, manager__id=uid, token=key).select_related("manager")
+            if (session := await query) is None:
+                raise ValueError
 
-        return session if session_ else session.manager
+            return session if session_ else session.manager
+
+        sid, uid, permissions = SessionTokens.verify(auth)
+        await SessionTokens.check_session(sid, uid, permissions)
+        manager = Manager(id=uid, permissions=permissions)
+        return Session(id=sid, manager_id=uid) if session_ else manager
     except ValueError:
         raise HTTPException(status_code=401, detail="No such session!")
 
@@ -50,7 +132,7 @@ async def authSession(request: Request):
 
 
 AuthManagerDep = Annotated[Manager, Depends(authManager)]
-AuthSessionDep = Annotated[Manager, Depends(authManager)]
+AuthSessionDep = Annotated[Session, Depends(authSession)]
 
 
 SEARCH_SUFFIX = {
@@ -64,6 +146,7 @@ SEARCH_SUFFIX = {
     "isEmpty": "__isnull",
     "isNotEmpty": "__not_isnull",
     "isAnyOf": "__in",
+    "between": "__range",
     "!=": "__not",
     "not": "__not",
     "after": "__gt",
@@ -75,40 +158,170 @@ SEARCH_SUFFIX = {
 }
 
 
-def search(model: Type[Model], data: SearchData):
-    fields = set(model.__annotations__.keys())
-    query = model.all()
-    filter_query = None
-    for item in data.filter.items:
-        filter_key = item.field
-        fk_ = filter_key.split("__")[0]
-        if fk_ not in fields or item.value is None or item.operator not in SEARCH_SUFFIX:
-            continue
+def pagination(page: int = 0, limit: int = 50, cursor: Optional[str] = None,
+               estimate: bool = False) -> PaginationModel:
+    return PaginationModel(page=page, pageSize=limit, cursor=cursor, estimate=estimate)
 
-        filter_key += SEARCH_SUFFIX[item.operator]
-        q = Q(**{filter_key: item.value})
 
-        if filter_query is None:
-            filter_query = q
-            continue
+PaginationDep = Annotated[PaginationModel, Depends(pagination)]
+
+
+def encode_cursor(values: list[Any]) -> str:
+    values = [["dt", value.isoformat()] if isinstance(value, datetime) else value for value in values]
+    return urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    try:
+        values = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list):
+            raise ValueError
+        return [datetime.fromisoformat(value[1]) if isinstance(value, list) else value for value in values]
+    except (ValueError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid cursor!")
+
 
-        if data.filter.logicOperator == "or":
-            filter_query |= q
+# Selects rows that are located after the row with given ordering values.
+# Nulls are handled the same way MySQL sorts them: first in ascending order, last in descending order.
+def keyset_filter(orderings: list[str], values: list[Any]) -> Q:
+    if len(orderings) != len(values):
+        raise HTTPException(status_code=400, detail="Invalid cursor!")
+
+    result = []
+    previous_equal = []
+    for ordering, value in zip(orderings, values):
+        field = ordering.lstrip("-")
+        desc = ordering.startswith("-")
+        if value is None:
+            after = None if desc else Q(**{f"{field}__not_isnull": True})
+            equal = Q(**{f"{field}__isnull": True})
         else:
-            filter_query &= q
+            after = Q(**{f"{field}__lt" if desc else f"{field}__gt": value})
+            if desc:
+                after |= Q(**{f"{field}__isnull": True})
+            equal = Q(**{field: value})
+
+        if after is not None:
+            result.append(Q(*previous_equal, after))
+        previous_equal.append(equal)
+
+    return Q(*result, join_type=Q.OR) if result else Q(id__in=[])
+
+
+def keyset_values(row: Model, orderings: list[str]) -> list[Any]:
+    return [getattr(row, ordering.lstrip("-")) for ordering in orderings]
+
+
+# Pages are offset-based unless cursor is passed. Empty cursor requests the first keyset-based page,
+# cursor of the next page is returned in "next_cursor".
+async def paginate(query: QuerySet, pagination: PaginationModel, orderings: list[str] = ("id",)) -> dict:
+    count = await cached_count(query, pagination.estimate)
+    query = query.order_by(*orderings).limit(pagination.pageSize)
+    if pagination.cursor is None:
+        return {"results": await query.offset(pagination.pageSize * pagination.page), "count": count}
+
+    if pagination.cursor:
+        query = query.filter(keyset_filter(orderings, decode_cursor(pagination.cursor)))
+
+    results = await query
+    next_cursor = None
+    if results and len(results) == pagination.pageSize:
+        next_cursor = encode_cursor(keyset_values(results[-1], orderings))
+
+    return {"results": results, "count": count, "next_cursor": next_cursor}
+
+
+async def iter_chunks(query: QuerySet, orderings: list[str] = ("id",), chunk_size: int = 1000) -> AsyncIterator[list]:
+    last_values = None
+    while True:
+        chunk_query = query.order_by(*orderings).limit(chunk_size)
+        if last_values is not None:
+            chunk_query = chunk_query.filter(keyset_filter(orderings, last_values))
+
+        rows = await chunk_query
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last_values = keyset_values(rows[-1], orderings)
+
+
+# Resolves filter field to a lookup on a real column, fk fields can be followed with "__" (e.g. "customer__email").
+def resolve_filter_field(model: Type[Model], field: str) -> Optional[str]:
+    name, _, rest = field.partition("__")
+    meta = model._meta
+    if name in meta.fk_fields or name in meta.o2o_fields:
+        if not rest:
+            return meta.fields_map[name].source_field
+        related = resolve_filter_field(meta.fields_map[name].related_model, rest)
+        return f"{name}__{related}" if related is not None else None
 
-    if filter_query is not None:
-        query = query.filter(filter_query)
+    return name if not rest and name in meta.fields_db_projection else None
+
+
+def resolve_sort_field(model: Type[Model], field: str) -> Optional[str]:
+    meta = model._meta
+    if field in meta.fk_fields or field in meta.o2o_fields:
+        return meta.fields_map[field].source_field
+    return field if field in meta.fields_db_projection else None
+
+
+# Returns value that should be passed to the lookup or None if the filter item should be ignored.
+def filter_value(operator: str, value: str | list[str] | None) -> Any:
+    if operator in ("isEmpty", "isNotEmpty"):
+        return True
+    if operator == "between":
+        return value if isinstance(value, list) and len(value) == 2 else None
+    if operator == "isAnyOf":
+        return (value or None) if isinstance(value, list) else [value] if value is not None else None
+    return value if isinstance(value, str) else None
+
+
+class CompiledSearch:
+    __slots__ = ("model", "filters", "logic", "orderings",)
+
+    def __init__(self, model: Type[Model], filters: list[tuple[int, str, str]], logic: str, orderings: list[str]):
+        self.model = model
+        self.filters = filters
+        self.logic = logic
+        self.orderings = orderings
+
+    def bind(self, items: list[FilterItem]) -> QuerySet:
+        filters = []
+        for idx, lookup, operator in self.filters:
+            if (value := filter_value(operator, items[idx].value)) is not None:
+                filters.append(Q(**{lookup: value}))
+
+        query = self.model.all()
+        if filters:
+            query = query.filter(Q(*filters, join_type=Q.OR if self.logic == "or" else Q.AND))
+        return query
+
+
+# Search requests are compiled once per model and filter/sort shape (fields and operators, without values),
+# unknown fields and operators are dropped at this step.
+@lru_cache(maxsize=1024)
+def compile_search(model: Type[Model], filters: tuple[tuple[str, str], ...], logic: str,
+                   sort: tuple[tuple[str, str], ...]) -> CompiledSearch:
+    compiled_filters = []
+    for idx, (field, operator) in enumerate(filters):
+        if operator not in SEARCH_SUFFIX or (lookup := resolve_filter_field(model, field)) is None:
+            continue
+        compiled_filters.append((idx, lookup + SEARCH_SUFFIX[operator], operator))
 
     orderings = []
-    for sort_item in data.sort:
-        if sort_item.field not in fields:
+    for field, direction in sort:
+        if (field := resolve_sort_field(model, field)) is None:
             continue
-        if sort_item.sort == "desc":
-            sort_item.field = f"-{sort_item.field}"
-        orderings.append(sort_item.field)
+        orderings.append(f"-{field}" if direction == "desc" else field)
+
+    if "id" not in orderings and "-id" not in orderings:
+        orderings.append("id")
+
+    return CompiledSearch(model, compiled_filters, logic, orderings)
 
-    if orderings:
-        query = query.order_by(*orderings)
 
-    return query.limit(data.pagination.pageSize).offset(data.pagination.pageSize * data.pagination.page), query
+def search(model: Type[Model], data: SearchData) -> tuple[QuerySet, list[str]]:
+    compiled = compile_search(model, tuple((item.field, item.operator) for item in data.filter.items),
+                              data.filter.logicOperator, tuple((item.field, item.sort) for item in data.sort))
+    return compiled.bind(data.filter.items), list(compiled.orderings)
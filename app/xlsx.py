@@ -0,0 +1,108 @@
+import pickle
+from datetime import datetime
+from tempfile import TemporaryFile
+from typing import Any, Optional, IO, Iterator
+
+from fastapi.responses import StreamingResponse
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill, Color
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.workbook import Workbook
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from starlette.concurrency import run_in_threadpool
+
+XLSX_MEDIA_TYPE = "application/vnd.ms-excel"
+CHUNK_SIZE = 64 * 1024
+
+
+class StyledValue:
+    __slots__ = ("value", "fill", "bold",)
+
+    def __init__(self, value: Any, fill: Optional[tuple[str, float]] = None, bold: bool = False):
+        self.value = value
+        self.fill = fill
+        self.bold = bold
+
+
+def iter_file(fp: IO[bytes]) -> Iterator[bytes]:
+    try:
+        while chunk := fp.read(CHUNK_SIZE):
+            yield chunk
+    finally:
+        fp.close()
+
+
+# Openpyxl write-only worksheets need column widths before the first row is written, so appended rows are
+# spooled to a temporary file while widths are calculated, and written to the workbook only when saving.
+class XlsxWriter:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.widths: dict[int, int] = {}
+        self._rows = TemporaryFile()
+        self._alignment = Alignment(horizontal="left", vertical="center")
+        self._fills: dict[tuple[str, float], PatternFill] = {}
+        self._bold = Font(bold=True)
+
+    def append(self, row: dict | list | tuple = ()) -> None:
+        if isinstance(row, dict):
+            columns = {column_index_from_string(col) if isinstance(col, str) else col: value
+                       for col, value in row.items()}
+            row = [columns.get(col) for col in range(1, max(columns, default=0) + 1)]
+
+        for col, value in enumerate(row, 1):
+            if isinstance(value, StyledValue):
+                value = value.value
+            if value is None:
+                continue
+            self.widths[col] = max(self.widths.get(col, 0), len(str(value)))
+
+        pickle.dump(list(row), self._rows)
+
+    def _cell(self, ws: WriteOnlyWorksheet, value: Any) -> Optional[WriteOnlyCell]:
+        style = value if isinstance(value, StyledValue) else None
+        if style is not None:
+            value = style.value
+        if value is None and style is None:
+            return None
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+
+        cell = WriteOnlyCell(ws, value=value)
+        cell.alignment = self._alignment
+        if style is not None and style.fill is not None:
+            if style.fill not in self._fills:
+                rgb, tint = style.fill
+                self._fills[style.fill] = PatternFill(start_color=Color(rgb, tint=tint), fill_type="solid")
+            cell.fill = self._fills[style.fill]
+        if style is not None and style.bold:
+            cell.font = self._bold
+
+        return cell
+
+    def save(self, fp: IO[bytes] | str) -> None:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for col, width in self.widths.items():
+            ws.column_dimensions[get_column_letter(col)].width = width + 2
+
+        self._rows.seek(0)
+        while True:
+            try:
+                row = pickle.load(self._rows)
+            except EOFError:
+                break
+            ws.append([self._cell(ws, value) for value in row])
+
+        wb.save(fp)
+        self._rows.close()
+
+    def _save_temp(self) -> IO[bytes]:
+        fp = TemporaryFile()
+        self.save(fp)
+        fp.seek(0)
+        return fp
+
+    async def response(self) -> StreamingResponse:
+        fp = await run_in_threadpool(self._save_temp)
+        return StreamingResponse(iter_file(fp), media_type=XLSX_MEDIA_TYPE,
+                                 headers={"Content-Disposition": f"attachment; filename=\"{self.filename}\""})
@@ -55,6 +55,28 @@ def test_get_categories():
         assert len(resp.json()["results"]) == 0
 
 
+def test_get_categories_cursor():
+    with TestClient(app) as client:
+        cats = [create_category(client, name=f"test{i}") for i in range(5)]
+
+        resp = client.get("/api/v0/categories?limit=2&cursor=")
+        assert resp.status_code == 200
+        assert resp.json()["count"] == 5
+        assert resp.json()["results"] == cats[:2]
+
+        resp = client.get(f"/api/v0/categories?limit=2&cursor={resp.json()['next_cursor']}")
+        assert resp.status_code == 200
+        assert resp.json()["results"] == cats[2:4]
+
+        resp = client.get(f"/api/v0/categories?limit=2&cursor={resp.json()['next_cursor']}")
+        assert resp.status_code == 200
+        assert resp.json()["results"] == cats[4:]
+        assert resp.json()["next_cursor"] is None
+
+        resp = client.get("/api/v0/categories?limit=2&cursor=invalid")
+        assert resp.status_code == 400
+
+
 def test_get_category():
     with TestClient(app) as client:
         cat1 = create_category(client, name="test")
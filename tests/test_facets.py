@@ -0,0 +1,19 @@
+from app.facets import typed_value
+
+
+def test_typed_value():
+    assert typed_value(" 15.5 ") == {"value": " 15.5 ", "value_key": "15.5", "value_number": 15.5}
+    assert typed_value(16) == {"value": "16", "value_key": "16", "value_number": 16.0}
+    assert typed_value("Black") == {"value": "Black", "value_key": "black", "value_number": None}
+    assert typed_value(True) == {"value": "1", "value_key": "1", "value_number": 1.0}
+    assert typed_value(False)["value"] == "0"
+
+
+def test_typed_value_not_finite():
+    assert typed_value("inf")["value_number"] is None
+    assert typed_value("NaN") == {"value": "NaN", "value_key": "nan", "value_number": None}
+
+
+def test_typed_value_long():
+    value = "A" * 300
+    assert typed_value(value) == {"value": value, "value_key": "a" * 255, "value_number": None}
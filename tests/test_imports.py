@@ -0,0 +1,69 @@
+from asyncio import get_event_loop
+from io import BytesIO
+
+import pytest as pt
+from fastapi import HTTPException
+from openpyxl import Workbook
+
+from app.imports import ProductImport
+
+
+def open_import(data: bytes, fmt: str) -> ProductImport:
+    product_import = ProductImport(BytesIO(data), fmt)
+    get_event_loop().run_until_complete(product_import.open())
+    return product_import
+
+
+def parse(product_import: ProductImport) -> tuple[list, list]:
+    rows, errors = product_import._parse(product_import._next_rows(100))
+    return [(row_number, data.model_dump(exclude_none=True), chars) for row_number, data, chars in rows], errors
+
+
+def test_parse_csv():
+    data = (
+        "\ufeffModel,manufacturer,price,quantity,category,char:Color,unknown,char:\n"
+        "m1,Man,100.5,5,Phones,Black,x,y\n"
+        ",,,,,,,\n"
+        "m2, Man ,,,, ,,\n"
+        "m3,Man,-1,abc,,,,\n"
+        ",Man,1,,,,,\n"
+    ).encode()
+    product_import = open_import(data, "csv")
+    assert product_import.columns == [("product", "model"), ("product", "manufacturer"), ("product", "price"),
+                                      ("product", "quantity"), ("product", "category"), ("char", "Color"), None, None]
+
+    rows, errors = parse(product_import)
+    assert rows == [
+        (2, {"model": "m1", "manufacturer": "Man", "price": 100.5, "quantity": 5, "category": "Phones"},
+         {"Color": "Black"}),
+        (4, {"model": "m2", "manufacturer": "Man"}, {}),
+    ]
+    assert [error["row"] for error in errors] == [5, 6]
+    assert "price" in errors[0]["error"] and "quantity" in errors[0]["error"]
+    assert "model" in errors[1]["error"]
+
+
+def test_parse_xlsx():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["model", "manufacturer", "price", "warranty_days", "char:Weight"])
+    ws.append(["m1", "Man", 100.0, 14.0, 1.5])
+    ws.append([None, None, None, None, None])
+    ws.append([12345, "Man", 10, None, "  "])
+    fp = BytesIO()
+    wb.save(fp)
+
+    rows, errors = parse(open_import(fp.getvalue(), "xlsx"))
+    assert rows == [
+        (2, {"model": "m1", "manufacturer": "Man", "price": 100.0, "warranty_days": 14}, {"Weight": "1.5"}),
+        (4, {"model": "12345", "manufacturer": "Man", "price": 10.0}, {}),
+    ]
+    assert errors == []
+
+
+@pt.mark.parametrize("data,fmt", [(b"model,price\nm1,1\n", "csv"), (b"", "csv"), (b"not a zip file", "xlsx"),
+                                  (b"\xff\xfe\x00model", "csv")])
+def test_open_invalid(data, fmt):
+    with pt.raises(HTTPException) as exc:
+        open_import(data, fmt)
+    assert exc.value.status_code == 400
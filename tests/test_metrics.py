@@ -0,0 +1,57 @@
+import pytest as pt
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.metrics import Histogram, Metrics, MetricsMiddleware, render_metrics
+
+
+@pt.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    for name in ("requests", "durations", "request_queries", "request_db_time"):
+        monkeypatch.setattr(Metrics, name, {})
+    monkeypatch.setattr(Metrics, "queries", 0)
+    monkeypatch.setattr(Metrics, "db_time", 0.0)
+
+
+def test_histogram():
+    histogram = Histogram((1, 5))
+    for value in (0, 1, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.lines("test", "a=\"b\"") == [
+        "test_bucket{a=\"b\",le=\"1\"} 2",
+        "test_bucket{a=\"b\",le=\"5\"} 3",
+        "test_bucket{a=\"b\",le=\"+Inf\"} 4",
+        "test_sum{a=\"b\"} 14.0",
+        "test_count{a=\"b\"} 4",
+    ]
+
+
+def test_render_metrics():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        Metrics.observe_query(0.002)
+        Metrics.observe_query(0.003)
+        return {"id": item_id}
+
+    with TestClient(app) as client:
+        assert client.get("/items/1").status_code == 200
+        assert client.get("/items/2").status_code == 200
+        assert client.get("/items/abc").status_code == 422
+        assert client.get("/unknown").status_code == 404
+    Metrics.observe_query(0.005)
+
+    text = render_metrics({"test_gauge": ("Test gauge.", 3)})
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert "http_requests_total{method=\"GET\",route=\"/items/{item_id}\",status=\"200\"} 2" in lines
+    assert "http_requests_total{method=\"GET\",route=\"/items/{item_id}\",status=\"422\"} 1" in lines
+    assert "http_requests_total{method=\"GET\",route=\"unmatched\",status=\"404\"} 1" in lines
+    assert "http_request_db_queries_bucket{method=\"GET\",route=\"/items/{item_id}\",le=\"2\"} 3" in lines
+    assert "http_request_db_queries_sum{method=\"GET\",route=\"/items/{item_id}\"} 4.0" in lines
+    assert "db_queries_total 5" in lines
+    assert "http_requests_in_flight 0" in lines
+    assert lines[-3:] == ["# HELP test_gauge Test gauge.", "# TYPE test_gauge gauge", "test_gauge 3"]
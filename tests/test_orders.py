@@ -5,6 +5,8 @@ from fastapi.testclient import TestClient
 
 from app.db import database
 from app.main import app
+from app.models import Product
+from app.routes import orders
 from tests.utils import create_category, create_product, cleanup_db, create_manager, create_order
 
 
@@ -39,3 +41,56 @@ def test_create_order():
         assert ord1["customer"] != ord3["customer"]
         assert len(ord1["items"]) == 3
         assert ord1["items"] == ord2["items"] == ord3["items"]
+
+
+def test_get_orders():
+    with TestClient(app) as client:
+        cat = create_category(client, name="test")
+        create_manager(client, first_name="First test", last_name="Last test", email="first.last@test.nure.ua",
+                       password="123456789")
+
+        prod1 = create_product(client, model="test1", manufacturer="m", price=100, quantity=10, category_id=cat["id"])
+        prod2 = create_product(client, model="test2", manufacturer="m", price=150, quantity=10, category_id=cat["id"])
+
+        cust = {"first_name": "test", "last_name": "test", "email": "test.test@test.nure.ua", "phone_number": 123}
+        ord1 = create_order(client, customer_info=cust, address="test", type="shipping",
+                            products=[{"id": prod1["id"], "quantity": 1}])
+        ord2 = create_order(client, customer_info=cust, address="test", type="shipping",
+                            products=[{"id": prod1["id"], "quantity": 2}, {"id": prod2["id"], "quantity": 3}])
+
+        resp = client.get("/api/v0/orders")
+        assert resp.status_code == 200
+        assert resp.json()["count"] == 2
+        assert resp.json()["results"] == [ord1, ord2]
+        assert [len(order["items"]) for order in resp.json()["results"]] == [1, 2]
+
+
+def test_create_order_stock_changed(monkeypatch):
+    decrement_stock = orders.decrement_stock
+
+    # stock drops below the ordered quantity after limits were computed (as if another order took it), the update
+    # runs in the order transaction, so it's rolled back together with the order
+    async def stock_changed(conn, quantities):
+        await Product.filter(id__in=list(quantities)).update(quantity=1)
+        return await decrement_stock(conn, quantities)
+
+    with TestClient(app) as client:
+        cat = create_category(client, name="test")
+        create_manager(client, first_name="First test", last_name="Last test", email="first.last@test.nure.ua",
+                       password="123456789")
+        prod = create_product(client, model="test1", manufacturer="m", price=100, quantity=10, category_id=cat["id"])
+
+        monkeypatch.setattr(orders, "decrement_stock", stock_changed)
+        cust = {"first_name": "test", "last_name": "test", "email": "test.test@test.nure.ua", "phone_number": 123}
+        resp = client.post("/api/v0/orders", json={"customer_info": cust, "address": "test", "type": "shipping",
+                                                   "products": [{"id": prod["id"], "quantity": 2}]})
+        assert resp.status_code == 409
+
+        # whole order is rolled back: neither the order nor stock changes are left
+        resp = client.get("/api/v0/orders")
+        assert resp.status_code == 200
+        assert resp.json()["count"] == 0
+
+        resp = client.get(f"/api/v0/products/{prod['id']}")
+        assert resp.status_code == 200
+        assert resp.json()["quantity"] == 10
@@ -1,3 +1,4 @@
+import json
 from asyncio import get_event_loop
 
 import pytest as pt
@@ -107,3 +108,34 @@ def test_delete_category():
         resp = client.get("/api/v0/products")
         assert resp.status_code == 200
         assert resp.json()["results"] == []
+
+
+def test_import_products():
+    with TestClient(app) as client:
+        prod = create_product(client, model="test1", manufacturer="m", price=100)
+
+        data = (
+            "model,manufacturer,price,quantity,category,char:Color\n"
+            "test1,M,150,,test,Black\n"
+            "test2,m,200,3,test,white\n"
+            "test3,m,,,,\n"
+        )
+        resp = client.post("/api/v0/products/import?fmt=csv", content=data.encode())
+        assert resp.status_code == 200
+        progress = [json.loads(line) for line in resp.text.splitlines()]
+        assert progress[-1] == {"processed": 3, "created": 1, "updated": 1, "failed": 1, "done": True}
+        assert progress[0]["errors"] == [{"row": 4, "error": "price: Field required for new products"}]
+
+        resp = client.get("/api/v0/products")
+        assert resp.status_code == 200
+        products = resp.json()["results"]
+        assert [(p["model"], p["price"], p["quantity"]) for p in products] == [("test1", 150, 0), ("test2", 200, 3)]
+        assert products[0]["id"] == prod["id"]
+        assert products[0]["category_id"] == products[1]["category_id"] is not None
+
+        resp = client.get(f"/api/v0/products/{prod['id']}/chars")
+        assert resp.status_code == 200
+        assert [(char["name"], char["value"]) for char in resp.json()] == [("Color", "Black")]
+
+        resp = client.post("/api/v0/products/import?fmt=csv", content=b"model,price\ntest4,1\n")
+        assert resp.status_code == 400
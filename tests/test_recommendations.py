@@ -0,0 +1,62 @@
+import numpy as np
+
+from app.recommendations import compute_recommendations
+
+
+def avg(values: list[float]) -> float:
+    return sum(values) / len(values) if values else 0
+
+
+# Algorithm of the old price-recommendations endpoint, days of each product must be sorted.
+def reference_recommendations(rows: list[tuple[int, float, int, int]]) -> dict[int, float]:
+    products = {}
+    for product_id, price, items, returns in rows:
+        products.setdefault(product_id, []).append({"price": price, "count": items, "returns": returns})
+
+    result = {}
+    for product_id, days in products.items():
+        if len(days) < 3:
+            continue
+        if all(day["count"] == days[0]["count"] and day["returns"] == days[0]["returns"] for day in days):
+            continue
+
+        counts = [day["count"] for day in days if day["count"] > 0]
+        buy = avg([(counts[i] - counts[i - 1]) / counts[i - 1] for i in range(1, len(counts))])
+        counts = [day["returns"] for day in days if day["returns"] > 0]
+        ret = -avg([(counts[i] - counts[i - 1]) / counts[i - 1] for i in range(1, len(counts))])
+
+        coef = buy * 1.2 + ret * 0.7
+        if -0.25 < coef < 0.25:
+            continue
+        price = days[0]["price"]
+        new_price_coef = abs(min(coef - 0.25, 0.5) / 10)
+        result[product_id] = round(price * (1 - new_price_coef if coef < 0 else 1 + new_price_coef), 2)
+
+    return result
+
+
+def test_compute_recommendations():
+    rows = [
+        (1, 1.9, 1, 0), (1, 1.9, 2, 0), (1, 1.9, 4, 0),  # rising sales, 1.9 * 1.05 = 1.9949999...
+        (2, 3, 4, 0), (2, 3, 2, 0), (2, 3, 1, 0),  # falling sales, 3 * 0.915 = 2.745
+        (3, 10, 5, 1), (3, 10, 5, 1), (3, 10, 5, 1),  # same sales every day
+        (4, 10, 1, 0), (4, 10, 5, 0),  # sold on less than 3 days
+        (5, 10, 10, 0), (5, 10, 11, 0), (5, 10, 10, 0),  # small change
+        (6, 99.99, 3, 1), (6, 99.99, 0, 2), (6, 99.99, 6, 4), (6, 99.99, 7, 1),  # returns and days without sales
+        (7, 250.5, 2, 0), (7, 250.5, 3, 0), (7, 250.5, 5, 1), (7, 250.5, 4, 0),
+    ]
+    sales = {
+        "ids": np.array([row[0] for row in rows], dtype=np.int64),
+        "prices": np.array([row[1] for row in rows], dtype=np.float64),
+        "items": np.array([row[2] for row in rows], dtype=np.float64),
+        "returns": np.array([row[3] for row in rows], dtype=np.float64),
+    }
+
+    recommendations = compute_recommendations(sales)
+    assert [rec["product_id"] for rec in recommendations] == [1, 2, 3, 4, 5, 6, 7]
+    assert {rec["product_id"]: rec["recommended_price"] for rec in recommendations
+            if rec["action"] is not None} == reference_recommendations(rows)
+    assert {rec["product_id"]: rec["action"] for rec in recommendations} == \
+           {1: "up", 2: "down", 3: None, 4: None, 5: None, 6: "up", 7: "up"}
+    assert recommendations[0]["recommended_price"] == 1.99
+    assert recommendations[1]["recommended_price"] == 2.75
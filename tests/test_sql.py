@@ -0,0 +1,38 @@
+from app.routes.sql import plan_warnings, is_read_query
+
+
+def test_plan_warnings():
+    plan = {
+        "query_block": {
+            "select_id": 1,
+            "nested_loop": [
+                {"table": {"table_name": "order", "access_type": "ALL", "possible_keys": None,
+                           "rows_examined_per_scan": 1000, "attached_condition": "(`order`.`address` = 'test')"}},
+                {"table": {"table_name": "customer", "access_type": "eq_ref", "possible_keys": ["PRIMARY"],
+                           "key": "PRIMARY", "rows_examined_per_scan": 1}},
+                {"table": {"table_name": "orderitem", "access_type": "index", "possible_keys": None,
+                           "key": "fk_orderite_order_id", "rows_examined_per_scan": 50}},
+                {"table": {"table_name": "product", "access_type": "ALL", "possible_keys": ["PRIMARY"],
+                           "rows_examined_per_scan": 10}},
+                {"table": {"table_name": "manager", "access_type": "const", "possible_keys": None}},
+            ],
+        },
+    }
+
+    warnings = plan_warnings(plan)
+    assert [(warning["table"], warning["issues"]) for warning in warnings] == [
+        ("order", ["Full table scan", "No usable index"]),
+        ("orderitem", ["No usable index"]),
+        ("product", ["Full table scan"]),
+    ]
+    assert warnings[0]["rows"] == 1000
+    assert warnings[0]["condition"] == "(`order`.`address` = 'test')"
+    assert plan_warnings(None) == []
+
+
+def test_is_read_query():
+    assert is_read_query("SELECT * FROM product;")
+    assert is_read_query("  with a AS (SELECT 1) SELECT * FROM a")
+    assert not is_read_query("WITH a AS (SELECT 1) DELETE FROM product")
+    assert not is_read_query("UPDATE product SET price = 1")
+    assert not is_read_query("SELECT 1; DELETE FROM product")
@@ -0,0 +1,44 @@
+from datetime import datetime
+from time import time
+
+import pytest as pt
+from fastapi import HTTPException
+
+from app.models.manager import Manager
+from app.models.session import Session
+from app.utils import encode_cursor, decode_cursor, SessionTokens, TOKEN_TTL
+
+
+def test_cursor_roundtrip():
+    values = [1, "test", None, 1.5, datetime(2023, 11, 20, 12, 30, 15)]
+    cursor = encode_cursor(values)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == values
+
+
+@pt.mark.parametrize("cursor", ["invalid", "e30", encode_cursor([1])[:-2] + "!!", "W1td"])
+def test_cursor_invalid(cursor):
+    with pt.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_session_token():
+    token = SessionTokens.make(Session(id=10), Manager(id=5, permissions=3))
+    assert SessionTokens.verify(token) == (10, 5, 3)
+
+    SessionTokens.revoke_session(10)
+    with pt.raises(ValueError):
+        SessionTokens.verify(token)
+
+
+def test_session_token_invalid():
+    token = SessionTokens.make(Session(id=11), Manager(id=5, permissions=3))
+    sid, uid, _, issued_at, signature = token.split(".")
+
+    tampered = f"{sid}.{uid}.1.{issued_at}.{signature}"
+    expired_payload = f"{sid}.{uid}.3.{int(time()) - TOKEN_TTL - 1}"
+    expired = f"{expired_payload}.{SessionTokens.sign(expired_payload)}"
+    for token in (tampered, expired, f"{sid}.{uid}.3.{issued_at}.ÿ", "", "1.2", token[:-1]):
+        with pt.raises(ValueError):
+            SessionTokens.verify(token)
@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+from io import BytesIO
+
+from openpyxl import load_workbook
+
+from app.xlsx import XlsxWriter, StyledValue
+
+
+def test_xlsx_writer():
+    writer = XlsxWriter("test.xlsx")
+    writer.append(["Name", "Price", "Created"])
+    writer.append({"A": "long product name", "B": 100, "C": datetime(2023, 11, 20, 12, 30, tzinfo=timezone.utc)})
+    writer.append({2: StyledValue(250, fill=("FF0000", 0.5), bold=True)})
+    writer.append()
+    writer.append(["last"])
+    assert writer.widths == {1: len("long product name"), 2: len("Price"), 3: len("2023-11-20 12:30:00+00:00")}
+
+    fp = BytesIO()
+    writer.save(fp)
+    ws = load_workbook(fp).active
+    assert [[cell.value for cell in row] for row in ws.iter_rows()] == [
+        ["Name", "Price", "Created"],
+        ["long product name", 100, datetime(2023, 11, 20, 12, 30)],
+        [None, 250, None],
+        [None, None, None],
+        ["last", None, None],
+    ]
+    assert ws["B3"].font.bold
+    assert ws["B3"].fill.fill_type == "solid"
+    assert ws.column_dimensions["A"].width == len("long product name") + 2